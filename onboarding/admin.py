@@ -1,4 +1,5 @@
 from django.contrib import admin
-from .models import Candidate
+from .models import Candidate, Message
 
 admin.site.register(Candidate)
+admin.site.register(Message)
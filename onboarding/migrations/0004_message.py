@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-14 09:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onboarding', '0003_candidate_preferred_language_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(max_length=10)),
+                ('text', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('candidate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='onboarding.candidate')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['candidate', '-created'], name='message_candidate_created')],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations
+
+BATCH_SIZE = 5000
+
+
+def history_to_messages(apps, schema_editor):
+    Candidate = apps.get_model('onboarding', 'Candidate')
+    Message = apps.get_model('onboarding', 'Message')
+
+    batch = []
+    candidates = Candidate.objects.exclude(history=None).only('history', 'last_updated')
+    for candidate in candidates.iterator():
+        # Entries carry no timestamps; ids keep their original order
+        for entry in candidate.history or []:
+            batch.append(Message(
+                candidate_id=candidate.pk,
+                role=entry.get('from', ''),
+                text=entry.get('text', ''),
+                created=candidate.last_updated,
+            ))
+        if len(batch) >= BATCH_SIZE:
+            Message.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+            batch = []
+    Message.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+
+
+def messages_to_history(apps, schema_editor):
+    Candidate = apps.get_model('onboarding', 'Candidate')
+    Message = apps.get_model('onboarding', 'Message')
+
+    histories = {}
+    for candidate_id, role, text in (
+        Message.objects.order_by('candidate_id', 'created', 'id')
+        .values_list('candidate_id', 'role', 'text')
+        .iterator()
+    ):
+        histories.setdefault(candidate_id, []).append({'from': role, 'text': text})
+    for candidate_id, history in histories.items():
+        Candidate.objects.filter(pk=candidate_id).update(history=history)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onboarding', '0004_message'),
+    ]
+
+    operations = [
+        migrations.RunPython(history_to_messages, messages_to_history),
+    ]
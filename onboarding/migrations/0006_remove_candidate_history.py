@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-14 09:29
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onboarding', '0005_copy_history_to_messages'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='candidate',
+            name='history',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-14 09:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onboarding', '0007_processed_message'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='role',
+            field=models.CharField(choices=[('user', 'User'), ('bot', 'Bot'), ('admin', 'Admin'), ('state', 'State'), ('summary', 'Summary')], max_length=10),
+        ),
+    ]
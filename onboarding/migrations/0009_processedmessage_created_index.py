@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-14 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onboarding', '0008_message_role_choices'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='processedmessage',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
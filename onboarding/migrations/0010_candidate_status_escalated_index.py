@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-14 09:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onboarding', '0009_processedmessage_created_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='candidate',
+            index=models.Index(condition=models.Q(('status', 'escalated')), fields=['status'], name='cand_status_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.3 on 2026-10-14 09:45
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_user_messages(apps, schema_editor):
+    Candidate = apps.get_model('onboarding', 'Candidate')
+    Message = apps.get_model('onboarding', 'Message')
+
+    user_messages = (
+        Message.objects.filter(candidate=OuterRef('pk'), role='user')
+        .values('candidate').annotate(n=Count('id')).values('n')
+    )
+    Candidate.objects.update(user_message_count=Coalesce(Subquery(user_messages), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onboarding', '0010_candidate_status_escalated_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='candidate',
+            name='user_message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_user_messages, migrations.RunPython.noop),
+    ]
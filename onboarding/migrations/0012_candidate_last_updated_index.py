@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-14 10:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('onboarding', '0011_candidate_user_message_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='candidate',
+            index=models.Index(fields=['-last_updated'], name='cand_last_updated_idx'),
+        ),
+    ]
@@ -1,16 +1,124 @@
 from django.db import models
+from django.utils import timezone
+
 
 class Candidate(models.Model):
     name = models.CharField(max_length=100)
     surname = models.CharField(max_length=100)
     phone_number = models.CharField(max_length=20, unique=True)
     status = models.CharField(max_length=20, default='sent')
-    history = models.JSONField(null=True, blank=True)
     last_updated = models.DateTimeField(auto_now=True)
     escalation_reason = models.CharField(max_length=255, null=True, blank=True)
-    processed_message_ids = models.JSONField(default=list, blank=True)
+    # Language of the chat so far. Candidates are onboarded in Italian, so a
+    # new chat whose first message has no language markers is answered in it
     preferred_language = models.CharField(max_length=10, default='it')
+    # Inbound messages so far; kept by process_webhook_message so the
+    # per-message checks don't COUNT the user's Message rows
+    user_message_count = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            # The admin panel polls the escalated list; only those rows are indexed
+            models.Index(fields=['status'], name='cand_status_idx', condition=models.Q(status='escalated')),
+            # The chat list and the upload page read candidates newest first
+            models.Index(fields=['-last_updated'], name='cand_last_updated_idx'),
+        ]
 
     def __str__(self):
         return self.name or self.phone_number
+
+    @classmethod
+    def upsert(cls, phone_number, **defaults):
+        """
+        Create the candidate if missing, or bump last_updated on the existing
+        row, in one INSERT ... ON CONFLICT (phone_number) DO UPDATE: no
+        get_or_create race and no savepoint. The INSERT only returns the pk,
+        so the stored row is then read back by it.
+        """
+        (obj,) = cls.objects.bulk_create(
+            [cls(phone_number=phone_number, **defaults)],
+            update_conflicts=True, unique_fields=['phone_number'], update_fields=['last_updated'],
+        )
+        return cls.objects.get(pk=obj.pk)
+
+    def append_history(self, *entries, **fields):
+        """
+        Append {"from": ..., "text": ...} entries as Message rows.
+        Extra keyword fields (e.g. status='replied') are written in the same
+        Candidate UPDATE that bumps last_updated.
+        """
+        if not entries:
+            return
+        Message.objects.bulk_create([
+            Message(candidate_id=self.pk, role=entry["from"], text=entry.get("text", ""))
+            for entry in entries
+        ])
+        self.touch(**fields)
+
+    def touch(self, **fields):
+        """
+        Bump last_updated and write `fields` in a single UPDATE.
+        F() expressions are evaluated in SQL and not copied onto the instance.
+        """
+        for field, value in fields.items():
+            if not hasattr(value, 'resolve_expression'):
+                setattr(self, field, value)
+        self.last_updated = timezone.now()
+        Candidate.objects.filter(pk=self.pk).update(last_updated=self.last_updated, **fields)
+
+    def history_entries(self, roles=None, limit=None):
+        """
+        History as {"from": ..., "text": ...} dicts, oldest first.
+        With limit, only the latest `limit` entries are read (one index seek).
+        """
+        qs = self.messages.all()
+        if roles:
+            qs = qs.filter(role__in=roles)
+        qs = qs.order_by('-created', '-id')
+        if limit:
+            qs = qs[:limit]
+        rows = list(qs.values_list('role', 'text'))
+        rows.reverse()
+        return [{"from": role, "text": text} for role, text in rows]
+
+    def latest_text(self, role):
+        """Text of the most recent entry with the given role, or None."""
+        return (
+            self.messages.filter(role=role)
+            .order_by('-created', '-id')
+            .values_list('text', flat=True)
+            .first()
+        )
+
+
+class Message(models.Model):
+    """One chat history entry (chat turn, or the bot's state / summary memory)."""
+    ROLE_CHOICES = [
+        ('user', 'User'),
+        ('bot', 'Bot'),
+        ('admin', 'Admin'),
+        ('state', 'State'),
+        ('summary', 'Summary'),
+    ]
+
+    candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE, related_name='messages')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    text = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['candidate', '-created'], name='message_candidate_created'),
+        ]
+
+    def __str__(self):
+        return f"{self.role}: {self.text[:50]}"
+
+
+class ProcessedMessage(models.Model):
+    """Meta message ids already handled; the unique insert makes webhook retries no-ops."""
+    message_id = models.CharField(max_length=128, unique=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.message_id
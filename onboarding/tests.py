@@ -1,15 +1,849 @@
+from django.core.cache import cache
+from django.db import OperationalError
 from django.test import TestCase, Client
+from django.utils import timezone
 from django.core.files.uploadedfile import SimpleUploadedFile
-from unittest.mock import patch, Mock
+from unittest.mock import ANY, AsyncMock, patch, Mock
+from datetime import timedelta
+import asyncio
+import io
 import json
+import openpyxl
+import requests
+import threading
 import pandas as pd
 
 from onboarding import views
-from onboarding.models import Candidate
+from onboarding.models import Candidate, ProcessedMessage
+
+
+class CandidateHistoryTests(TestCase):
+    def test_append_history_keeps_concurrent_appends(self):
+        Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000009")
+        first = Candidate.objects.get(phone_number="393330000009")
+        second = Candidate.objects.get(phone_number="393330000009")
+
+        first.append_history({"from": "user", "text": "ciao"})
+        second.append_history({"from": "bot", "text": "Ciao!"}, status="replied")
+
+        stored = Candidate.objects.get(phone_number="393330000009")
+        self.assertEqual([m["from"] for m in stored.history_entries()], ["user", "bot"])
+        self.assertEqual(stored.status, "replied")
+
+    def test_history_entries_limit_returns_latest_oldest_first(self):
+        candidate = Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000010")
+        candidate.append_history(*[{"from": "user", "text": str(i)} for i in range(5)])
+        candidate.append_history({"from": "state", "text": "{}"})
+
+        self.assertEqual(
+            [m["text"] for m in candidate.history_entries(roles=("user",), limit=2)], ["3", "4"]
+        )
+        self.assertEqual(candidate.latest_text("state"), "{}")
+        self.assertIsNone(candidate.latest_text("summary"))
+
+
+class DetectLanguageTests(TestCase):
+    def test_detects_italian_and_english(self):
+        self.assertEqual(views.detect_language("Ciao, come carico il documento?"), "it")
+        self.assertEqual(views.detect_language("Hi, how do I upload the document?"), "en")
+        self.assertEqual(views.detect_language("good morning"), "en")
+
+    def test_markers_match_whole_words_only(self):
+        # "le" inside "hello" and "no" inside "nome" used to skew the score
+        self.assertEqual(views.detect_language("hello"), "en")
+        self.assertEqual(views.detect_language("nome e cognome"), "it")
+
+    def test_text_without_markers_keeps_the_default(self):
+        self.assertEqual(views.detect_language("ok 👍", "it"), "it")
+        self.assertEqual(views.detect_language("ok 👍"), "en")
+        self.assertEqual(views.detect_language("thanks", "it"), "en")
+
+
+class PhoneNormalizationTests(TestCase):
+    def test_normalize_phone(self):
+        self.assertEqual(views.normalize_phone("+39 333-123 (45)"), "3933312345")
+        self.assertEqual(views.normalize_phone("tel: 39 333 123"), "39333123")
+        self.assertEqual(views.normalize_phone(393331234567.0), "393331234567")
+        self.assertEqual(views.normalize_phone(float("nan")), "")
+        self.assertEqual(views.normalize_phone(None), "")
+        self.assertEqual(views.normalize_phone(pd.NA), "")
+
+    def test_normalize_phone_column_matches_normalize_phone(self):
+        phones = pd.Series(["+39 333 123 4567", "(39) 333-7654321", None])
+        self.assertEqual(
+            views.normalize_phone_column(phones).tolist()[:2],
+            [views.normalize_phone("+39 333 123 4567"), "393337654321"],
+        )
+        self.assertTrue(pd.isna(views.normalize_phone_column(phones)[2]))
+
+    def test_float_column_keeps_integral_digits(self):
+        phones = pd.Series([393331234567.0, float("nan")])
+        self.assertEqual(views.normalize_phone_column(phones)[0], "393331234567")
+
+
+class StateObjectsTests(TestCase):
+    def test_returns_latest_state_and_summary(self):
+        candidate = Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000011")
+        self.assertEqual(views.get_state_objects(candidate), (None, None))
+
+        candidate.append_history(
+            {"from": "summary", "text": "old summary"},
+            {"from": "state", "text": json.dumps({"step": "docs"})},
+            {"from": "user", "text": "ciao"},
+            {"from": "summary", "text": "new summary"},
+            {"from": "state", "text": json.dumps({"step": "firma"})},
+            {"from": "bot", "text": "ok"},
+        )
+        state, summary = views.get_state_objects(candidate)
+        self.assertEqual(state, {"step": "firma"})
+        self.assertEqual(summary, "new summary")
+
+
+class SummaryTriggerTests(TestCase):
+    def setUp(self):
+        self.candidate = Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000060")
+        self.completion = Mock()
+        self.completion.choices = [Mock()]
+        self.completion.choices[0].message.content = "- vuole caricare i documenti"
+
+    @patch("onboarding.views.client.chat.completions.create")
+    def test_summarized_turns_do_not_retrigger(self, mock_create):
+        self.candidate.append_history(*[{"from": "user", "text": "ok"} for _ in range(70)])
+        self.candidate.append_history({"from": "summary", "text": "riassunto"}, {"from": "user", "text": "ciao"})
+
+        views.summarize_if_needed(self.candidate.pk)
+
+        self.assertFalse(mock_create.called)
+
+    @patch("onboarding.views.client.chat.completions.create")
+    def test_long_messages_trigger_on_token_budget(self, mock_create):
+        mock_create.return_value = self.completion
+        self.candidate.append_history(*[{"from": "user", "text": "x" * 9000} for _ in range(3)])
+
+        views.summarize_if_needed(self.candidate.pk)
+
+        self.assertEqual(self.candidate.latest_text("summary"), "- vuole caricare i documenti")
+
+    @patch("onboarding.views.client.chat.completions.create")
+    def test_database_errors_are_logged_not_raised(self, mock_create):
+        with patch("onboarding.views.Message.objects.filter", side_effect=OperationalError("database is locked")), \
+                self.assertLogs("onboarding.views", level="WARNING") as logs:
+            views.summarize_if_needed(self.candidate.pk)
+
+        self.assertIn("Summary failed: database is locked", logs.output[0])
+        self.assertFalse(mock_create.called)
+
+
+class ImmediateEscalationTests(TestCase):
+    def test_matches_phrases_case_insensitively(self):
+        self.assertTrue(views.check_immediate_escalation("Vorrei PARLARE CON UN OPERATORE, grazie"))
+        self.assertTrue(views.check_immediate_escalation("Can I talk to a person?"))
+        self.assertFalse(views.check_immediate_escalation("Come carico il documento?"))
+
+    def test_reports_language_of_matched_phrase(self):
+        self.assertEqual(views.immediate_escalation_language("Voglio parlare con qualcuno"), "it")
+        self.assertEqual(views.immediate_escalation_language("please, a REAL person"), "en")
+        self.assertIsNone(views.immediate_escalation_language("grazie"))
+        self.assertIsNone(views.immediate_escalation_language("ok" * 2000 + " tutto chiaro"))
+        self.assertEqual(views.immediate_escalation_language("HUMAN ASSISTANCE"), "en")
+
+
+class BackgroundEscalationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.candidate = Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000030",
+                                                  user_message_count=3)
+        self.candidate.append_history({"from": "user", "text": "non funziona niente"})
+        completion = Mock()
+        completion.choices = [Mock()]
+        completion.choices[0].message.content = json.dumps({"frustration_score": 9})
+        self.completion = completion
+
+    @patch("onboarding.views.send_escalation_email")
+    @patch("onboarding.views.BG_POOL.submit")
+    def test_classifier_is_awaited_off_the_pool(self, mock_submit, mock_email):
+        done = threading.Event()
+        mock_submit.side_effect = lambda *args: done.set()
+
+        with patch.object(views.aclient.chat.completions, "create", AsyncMock(return_value=self.completion)):
+            views.run_background_escalation_check(self.candidate, "non funziona niente")
+            self.assertTrue(done.wait(5))
+
+        # The GPT result comes back to BG_POOL; run that continuation here
+        fn, *args = mock_submit.call_args.args
+        fn(*args)
+
+        self.candidate.refresh_from_db()
+        self.assertEqual(self.candidate.status, "escalated")
+        mock_submit.assert_called_with(mock_email, self.candidate)
+
+    def test_classifier_prompt_prefix_is_static(self):
+        with patch.object(views.aclient.chat.completions, "create",
+                          AsyncMock(return_value=self.completion)) as mock_create:
+            scores = asyncio.run(views.classify_escalation("user: non funziona niente"))
+
+        self.assertEqual(scores, {"frustration_score": 9})
+        kwargs = mock_create.call_args.kwargs
+        system, user = kwargs["messages"]
+        self.assertEqual(system["content"], views.CLASSIFIER_PROMPT)
+        self.assertIn("user: non funziona niente", user["content"])
+        self.assertEqual(kwargs["response_format"], views.ESCALATION_SCORES_FORMAT)
+        self.assertEqual(kwargs["extra_body"], {"prompt_cache_key": "escalation_v1"})
+
+    @patch("onboarding.views.CLASSIFIER_DEADLINE", 0.1)
+    def test_slow_classifier_is_abandoned(self):
+        async def slow(**kwargs):
+            await asyncio.sleep(5)
+
+        with patch.object(views.aclient.chat.completions, "create", slow):
+            with self.assertRaises(asyncio.TimeoutError):
+                asyncio.run(views.classify_escalation("user: non funziona niente"))
+
+    def test_classifier_calls_are_capped(self):
+        in_flight, peak = 0, 0
+
+        async def create(**kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return self.completion
+
+        async def burst():
+            with patch.object(views, "CLASSIFIER_SLOTS", asyncio.Semaphore(2)):
+                return await asyncio.gather(*(views.classify_escalation(f"user: {i}") for i in range(6)))
+
+        with patch.object(views.aclient.chat.completions, "create", create):
+            results = asyncio.run(burst())
+
+        self.assertEqual(results, [{"frustration_score": 9}] * 6)
+        self.assertEqual(peak, 2)
+
+    def test_calm_messages_skip_the_classifier(self):
+        window = [("user", "come carico il documento?"), ("bot", "Vai su Documenti."), ("user", "ok grazie")]
+        self.assertFalse(views.needs_classifier("ok grazie", window + [("user", "ok grazie")]))
+        self.assertTrue(views.needs_classifier("Non funziona ANCORA", [("user", "Non funziona ANCORA")] * 2))
+        self.assertTrue(views.needs_classifier("perché??", [("user", "perché??")] * 2))
+        repeated = [("user", "Come firmo?"), ("bot", "..."), ("user", "come firmo?"), ("bot", "..."), ("user", "Come firmo?")]
+        self.assertTrue(views.needs_classifier("Come firmo?", repeated + [("user", "Come firmo?")]))
+
+        with patch.object(views.aclient.chat.completions, "create", AsyncMock()) as mock_create:
+            views.run_background_escalation_check(self.candidate, "ok grazie")
+        self.assertFalse(mock_create.called)
+
+    def test_new_conversations_skip_the_classifier(self):
+        self.candidate.user_message_count = 1
+
+        with patch.object(views.aclient.chat.completions, "create", AsyncMock()) as mock_create:
+            with self.assertNumQueries(0):
+                views.run_background_escalation_check(self.candidate, "non funziona niente")
+        self.assertFalse(mock_create.called)
+
+    @patch("onboarding.views.send_escalation_email")
+    def test_cached_scores_skip_the_classifier(self, mock_email):
+        window = "user: non funziona niente\nuser: non funziona niente"
+        cache.set(views.escalation_cache_key(window), {"frustration_score": 9})
+
+        with patch.object(views.aclient.chat.completions, "create", AsyncMock()) as mock_create:
+            views.run_background_escalation_check(self.candidate, "non funziona niente")
+
+        self.assertFalse(mock_create.called)
+        self.assertEqual(Candidate.objects.get(pk=self.candidate.pk).status, "escalated")
+
+
+class SmalltalkTests(TestCase):
+    def test_match_smalltalk_whole_message_only(self):
+        self.assertEqual(views.match_smalltalk("Grazie!"), "thanks")
+        self.assertEqual(views.match_smalltalk("ciao ciao"), "goodbye")
+        self.assertEqual(views.match_smalltalk("hello 👋"), "greeting")
+        self.assertIsNone(views.match_smalltalk("ciao, come carico il documento?"))
+        self.assertIsNone(views.match_smalltalk("ok"))
+
+    @patch("onboarding.views.client.chat.completions.create")
+    def test_orchestrated_reply_skips_gpt_for_smalltalk(self, mock_create):
+        candidate = Candidate.objects.create(name="Luca", surname="Bianchi", phone_number="393330000003")
+        candidate.append_history({"from": "user", "text": "ciao"})
+
+        reply, scores = views.orchestrated_reply(candidate, "ciao")
+
+        self.assertFalse(mock_create.called)
+        self.assertIn("Luca", reply)
+        self.assertIsNone(scores)
+
+
+class OrchestratedReplyTests(TestCase):
+    def test_normalize_reply_never_returns_json(self):
+        self.assertEqual(views.normalize_reply("  Vai su Documenti. ", "it"), "Vai su Documenti.")
+        self.assertEqual(views.normalize_reply('{"reply": "Ciao!", "intent": "other"}', "it"), "Ciao!")
+        self.assertEqual(views.normalize_reply('{"reply": "{}"}', "en"), "Ok.")
+        self.assertEqual(views.normalize_reply("{not json}", "en"), "Ok.")
+        self.assertEqual(views.normalize_reply({"text": "x"}, "it"), "Ok.")
+        self.assertEqual(views.normalize_reply(None, "it"), "Ok.")
+
+    def test_old_bot_turns_are_stubbed_in_the_transcript(self):
+        long_reply = "Per caricare i documenti vai nella sezione Documenti del portale e segui i passaggi."
+        entries = [{"from": "bot", "text": long_reply}, {"from": "user", "text": "x" * 80}] + [
+            {"from": "bot", "text": long_reply}, {"from": "user", "text": "ok"}] * 2
+
+        lines = list(views.transcript_lines(entries))
+
+        self.assertEqual(lines[0], f"bot: {long_reply[:60]}… ({len(long_reply)}c)")
+        self.assertEqual(lines[1], "user: " + "x" * 80)
+        self.assertEqual(lines[2:], [f"{m['from']}: {m['text']}" for m in entries[2:]])
+
+    @patch("onboarding.views.BG_POOL.submit")
+    @patch("onboarding.views.client.chat.completions.create")
+    def test_first_contact_reply_is_shared_between_candidates(self, mock_create, mock_submit):
+        cache.clear()
+        mock_create.return_value.choices = [Mock()]
+        mock_create.return_value.choices[0].message.content = json.dumps({"reply": "Vai su Registrazione."})
+        replies = []
+        for i, text in enumerate(["Come mi registro?", "come mi  REGISTRO?"]):
+            candidate = Candidate.objects.create(name="Luca", surname="Bianchi", phone_number=f"39333000001{i}",
+                                                 user_message_count=1)
+            candidate.append_history({"from": "user", "text": text})
+            replies.append(views.orchestrated_reply(candidate, text)[0])
+
+        self.assertEqual(replies, ["Vai su Registrazione."] * 2)
+        self.assertEqual(mock_create.call_count, 1)
+        self.assertEqual(mock_create.call_args.kwargs["extra_body"],
+                         {"prompt_cache_key": f"onboarding_it_{views.KB_VERSION}"})
+
+    def test_dialogue_starts_with_a_static_prefix(self):
+        candidate = Candidate.objects.create(name="Luca", surname="Bianchi", phone_number="393330000005")
+        first = views.build_dialogue_messages(candidate, "ciao", "it", True)
+        candidate.append_history({"from": "user", "text": "ciao"}, {"from": "bot", "text": "Benvenuto!"})
+        later = views.build_dialogue_messages(candidate, "come carico il documento?", "it", False)
+
+        self.assertEqual(first[0], later[0])
+        self.assertEqual(later[0]["content"], views.SYSTEM_PROMPTS["it"])
+        self.assertIn("Recent transcript:\nuser: ciao\nbot: Benvenuto!", [m["content"] for m in later])
+        self.assertEqual(later[-1], {"role": "user", "content": "come carico il documento?"})
+
+    @patch("onboarding.views.BG_POOL.submit")
+    @patch("onboarding.views.client.chat.completions.create")
+    def test_state_update_is_persisted_in_background(self, mock_create, mock_submit):
+        mock_submit.side_effect = lambda fn, *args: fn(*args)
+        mock_create.return_value.choices = [Mock()]
+        mock_create.return_value.choices[0].message.content = json.dumps({
+            "reply": "Vai su Documenti.",
+            "state_update": {"step": "docs"},
+        })
+        candidate = Candidate.objects.create(name="Luca", surname="Bianchi", phone_number="393330000004")
+        candidate.append_history({"from": "user", "text": "come carico il documento?"})
+
+        reply, scores = views.orchestrated_reply(candidate, "come carico il documento?")
+
+        self.assertEqual(reply, "Vai su Documenti.")
+        mock_submit.assert_called_once_with(views.persist_state, candidate.pk, {"step": "docs"})
+        self.assertEqual(candidate.history_entries()[-1], {"from": "state", "text": '{"step": "docs"}'})
+
+    @staticmethod
+    def stream_of(*parts):
+        chunks = []
+        for part in parts:
+            chunk = Mock()
+            chunk.choices = [Mock()]
+            chunk.choices[0].delta.content = part
+            chunks.append(chunk)
+        return chunks
+
+    @patch("onboarding.views.BG_POOL.submit")
+    @patch("onboarding.views.client.chat.completions.create")
+    def test_streamed_reply_is_handed_over_before_the_rest(self, mock_create, mock_submit):
+        events = []
+        chunks = self.stream_of('{"reply": "Vai su \\"Docu', 'menti\\"."', ', "state_update": {"step": "docs"}',
+                                ', "escalation": {"frustration_score": 1}}')
+
+        def stream(**kwargs):
+            for i, chunk in enumerate(chunks):
+                events.append(f"chunk{i}")
+                yield chunk
+
+        mock_create.side_effect = stream
+        candidate = Candidate.objects.create(name="Luca", surname="Bianchi", phone_number="393330000008",
+                                             user_message_count=2)
+
+        reply, scores = views.orchestrated_reply(candidate, "come carico il documento?", "it",
+                                                 on_reply=lambda text: events.append(text))
+
+        self.assertEqual(reply, 'Vai su "Documenti".')
+        self.assertEqual(events, ["chunk0", "chunk1", 'Vai su "Documenti".', "chunk2", "chunk3"])
+        self.assertEqual(scores, {"frustration_score": 1})
+        self.assertTrue(mock_create.call_args.kwargs["stream"])
+        mock_submit.assert_called_once_with(views.persist_state, candidate.pk, {"step": "docs"})
+
+    @patch("onboarding.views.client.chat.completions.create")
+    def test_stream_without_a_leading_reply_is_not_sent_early(self, mock_create):
+        mock_create.return_value = self.stream_of('{"intent": "docs_help", ', '"reply": "Vai su Documenti."}')
+        candidate = Candidate.objects.create(name="Luca", surname="Bianchi", phone_number="393330000009",
+                                             user_message_count=2)
+        on_reply = Mock()
+
+        reply, _ = views.orchestrated_reply(candidate, "come carico il documento?", "it", on_reply=on_reply)
+
+        self.assertEqual(reply, "Vai su Documenti.")
+        self.assertFalse(on_reply.called)
+
+    @patch("onboarding.views.client.chat.completions.create")
+    def test_truncated_json_reply_falls_back(self, mock_create):
+        mock_create.return_value.choices = [Mock()]
+        mock_create.return_value.choices[0].message.content = '{"reply": "Vai su Docu'
+        candidate = Candidate.objects.create(name="Luca", surname="Bianchi", phone_number="393330000007")
+
+        self.assertEqual(views.orchestrated_reply(candidate, "come carico il documento?"), ("Ok.", None))
+
+    def test_new_state_replaces_the_previous_one(self):
+        candidate = Candidate.objects.create(name="Luca", surname="Bianchi", phone_number="393330000006")
+        views.persist_state(candidate.pk, {"step": "registration"})
+        candidate.append_history({"from": "user", "text": "fatto"})
+        views.persist_state(candidate.pk, {"step": "docs"})
+
+        self.assertEqual(candidate.history_entries(), [
+            {"from": "user", "text": "fatto"},
+            {"from": "state", "text": '{"step": "docs"}'},
+        ])
+
+
+class MetaWebhookTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def payload(self, message_id, body="Ciao"):
+        return json.dumps({"entry": [{"changes": [{"value": {"messages": [
+            {"from": "393330000007", "id": message_id, "text": {"body": body}}
+        ]}}]}]})
+
+    @patch("onboarding.views.WEBHOOK_POOL.submit")
+    def test_retried_message_id_is_processed_once(self, mock_submit):
+        for _ in range(2):
+            response = self.client.post("/webhook/", self.payload("wamid.1"), content_type="application/json")
+            self.assertEqual(response.status_code, 200)
+
+        mock_submit.assert_called_once_with(views.process_webhook_message, "393330000007", "Ciao")
+
+    def test_claim_survives_a_cleared_cache(self):
+        self.assertTrue(views.claim_message("wamid.3"))
+        cache.clear()
+        self.assertFalse(views.claim_message("wamid.3"))
+
+    def test_failed_claim_lets_the_retry_through(self):
+        with patch("onboarding.views.ProcessedMessage.objects.create", side_effect=OperationalError("locked")):
+            with self.assertRaises(OperationalError):
+                views.claim_message("wamid.4")
+
+        self.assertTrue(views.claim_message("wamid.4"))
+
+    def test_prune_forgets_only_old_message_ids(self):
+        old = ProcessedMessage.objects.create(message_id="wamid.old")
+        ProcessedMessage.objects.filter(pk=old.pk).update(created=timezone.now() - timedelta(days=8))
+        ProcessedMessage.objects.create(message_id="wamid.new")
+
+        views.prune_processed_messages()
+
+        self.assertEqual(list(ProcessedMessage.objects.values_list("message_id", flat=True)), ["wamid.new"])
+
+    @patch("onboarding.views.WEBHOOK_POOL.submit")
+    def test_status_callbacks_are_ignored(self, mock_submit):
+        status_only = json.dumps({"entry": [{"changes": [{"value": {"statuses": [{"id": "wamid.1"}]}}]}]})
+
+        response = self.client.post("/webhook/", status_only, content_type="application/json")
+
+        self.assertEqual(response.json(), {"status": "ignored"})
+        self.assertFalse(mock_submit.called)
+
+    @patch("onboarding.views.APP_SECRET", "secret")
+    @patch("onboarding.views.WEBHOOK_POOL.submit")
+    def test_rejects_bad_signature(self, mock_submit):
+        response = self.client.post(
+            "/webhook/", self.payload("wamid.2"), content_type="application/json",
+            HTTP_X_HUB_SIGNATURE_256="sha256=bad",
+        )
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(mock_submit.called)
+
+
+class ChatHistoryTests(TestCase):
+    def test_limit_returns_the_newest_entries(self):
+        candidate = Candidate.objects.create(name="A", surname="A", phone_number="393330000070")
+        candidate.append_history(*[{"from": "user", "text": str(i)} for i in range(5)])
+
+        data = self.client.get("/get_chat_history/", {"phone": "393330000070", "limit": 2}).json()
+        self.assertEqual(data["history"], [{"from": "user", "text": "3"}, {"from": "user", "text": "4"}])
+        self.assertEqual(len(self.client.get("/get_chat_history/", {"phone": "393330000070"}).json()["history"]), 5)
+        self.assertEqual(self.client.get("/get_chat_history/", {"phone": "393330000070", "limit": "x"}).status_code, 400)
+
+
+class AllChatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_lists_candidates_with_their_last_message(self):
+        Candidate.objects.create(name="A", surname="A", phone_number="393330000071")
+        chatting = Candidate.objects.create(name="B", surname="B", phone_number="393330000072", status="replied")
+        chatting.append_history({"from": "user", "text": "ciao"}, {"from": "bot", "text": "Benvenuto!"})
+
+        with self.assertNumQueries(1):
+            data = self.client.get("/get_all_chats/").json()
+
+        self.assertEqual(len(data), 1)
+        self.assertEqual({k: data[0][k] for k in ("phone_number", "status", "last_message", "last_sender")},
+                         {"phone_number": "393330000072", "status": "replied",
+                          "last_message": "Benvenuto!", "last_sender": "bot"})
+
+    def test_state_and_summary_rows_are_not_the_last_message(self):
+        candidate = Candidate.objects.create(name="B", surname="B", phone_number="393330000073")
+        candidate.append_history({"from": "user", "text": "ciao"}, {"from": "bot", "text": "Benvenuto!"})
+        views.persist_state(candidate.pk, {"step": "docs"})
+        candidate.append_history({"from": "summary", "text": "- saluta"})
+
+        data = self.client.get("/get_all_chats/").json()
+
+        self.assertEqual((data[0]["last_message"], data[0]["last_sender"]), ("Benvenuto!", "bot"))
+
+
+class ReportStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_stats_are_aggregated_in_the_database(self):
+        done = Candidate.objects.create(name="A", surname="A", phone_number="393330000020", status="replied")
+        done.append_history(*[{"from": "bot", "text": "step"} for _ in range(6)], {"from": "user", "text": "ok"})
+        Candidate.objects.create(name="B", surname="B", phone_number="393330000021", status="escalated",
+                                 escalation_reason="Immediate escalation (explicit request)")
+        Candidate.objects.create(name="C", surname="C", phone_number="393330000022", status="escalated")
+        Candidate.objects.create(name="D", surname="D", phone_number="393330000023")
+
+        with self.assertNumQueries(3):
+            data = self.client.get("/get_report_stats/").json()
+
+        self.assertEqual(data["summary"]["total_users"], 4)
+        self.assertEqual(data["summary"]["total_messages"], 7)
+        self.assertEqual(data["summary"]["bot_messages"], 6)
+        self.assertEqual(data["engagement_funnel"],
+                         {"sent": 1, "replied": 1, "completed_onboarding": 1, "escalated": 2})
+        self.assertEqual(data["escalation_stats"], {"total_escalated": 2, "with_reason": 1})
+
+    def test_admin_endpoints_are_cached_until_a_write(self):
+        Candidate.objects.create(name="B", surname="B", phone_number="393330000024", status="escalated")
+        self.client.get("/get_escalated/")
+        self.client.get("/get_report_stats/")
+
+        with self.assertNumQueries(0):
+            escalated = self.client.get("/get_escalated/").json()
+            stats = self.client.get("/get_report_stats/").json()
+        self.assertEqual([c["phone_number"] for c in escalated], ["393330000024"])
+        self.assertEqual(stats["engagement_funnel"]["escalated"], 1)
+
+        self.client.post("/resume_bot/", data=json.dumps({"phone_number": "393330000024"}),
+                         content_type="application/json")
+
+        self.assertEqual(self.client.get("/get_escalated/").json(), [])
+        self.assertEqual(self.client.get("/get_report_stats/").json()["engagement_funnel"]["escalated"], 0)
+
+
+class CandidateUpsertTests(TestCase):
+    def test_existing_row_is_returned_unchanged(self):
+        stored = Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000074",
+                                          status="escalated", preferred_language="en", user_message_count=3)
+
+        candidate = Candidate.upsert("393330000074", name="Unknown", surname="Unknown")
+
+        self.assertEqual(candidate.pk, stored.pk)
+        self.assertEqual((candidate.name, candidate.status, candidate.preferred_language, candidate.user_message_count),
+                         ("Anna", "escalated", "en", 3))
+        self.assertEqual(Candidate.objects.count(), 1)
+
+
+class ProcessWebhookMessageTests(TestCase):
+    @patch("onboarding.views.BG_POOL.submit")
+    @patch("onboarding.views.send_text_message")
+    @patch("onboarding.views.orchestrated_reply", return_value=("Vai su Documenti.", None))
+    def test_reply_turn_query_count(self, mock_reply, mock_send, mock_submit):
+        candidate = Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000040")
+
+        # Candidate upsert + SELECT; user INSERT + counter UPDATE in a
+        # savepoint; bot INSERT + status UPDATE
+        with self.assertNumQueries(8):
+            views.process_webhook_message("393330000040", "Come carico il documento?")
+
+        candidate.refresh_from_db()
+        self.assertEqual(candidate.status, "replied")
+        self.assertEqual(candidate.user_message_count, 1)
+        self.assertEqual([m["from"] for m in candidate.history_entries()], ["user", "bot"])
+        mock_send.assert_called_once_with("393330000040", "Vai su Documenti.")
+        # Language detected once and shared by the summary and the reply
+        mock_submit.assert_any_call(views.summarize_if_needed, candidate.pk, "it")
+        self.assertEqual(mock_reply.call_args.args[1:], ("Come carico il documento?", "it"))
+
+    @patch("onboarding.views.BG_POOL.submit")
+    @patch("onboarding.views.send_text_message", side_effect=ConnectionError("meta down"))
+    @patch("onboarding.views.orchestrated_reply", return_value=("Vai su Documenti.", None))
+    def test_user_turn_is_counted_even_if_the_turn_fails(self, mock_reply, mock_send, mock_submit):
+        candidate = Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000047")
+
+        views.process_webhook_message("393330000047", "Come carico il documento?")
+
+        candidate.refresh_from_db()
+        self.assertEqual(candidate.user_message_count, 1)
+        self.assertEqual(candidate.messages.filter(role="user").count(), 1)
+
+    @patch("onboarding.views.BG_POOL.submit")
+    @patch("onboarding.views.send_text_message")
+    @patch("onboarding.views.orchestrated_reply", return_value=("Ciao!", None))
+    def test_new_sender_is_created_by_the_upsert(self, mock_reply, mock_send, mock_submit):
+        # A new sender costs the same queries as a known one
+        with self.assertNumQueries(8):
+            views.process_webhook_message("393330000043", "Ciao")
+
+        candidate = Candidate.objects.get(phone_number="393330000043")
+        self.assertEqual((candidate.name, candidate.surname), ("Unknown", "Unknown"))
+        self.assertEqual(candidate.status, "replied")
+        self.assertEqual(candidate.preferred_language, "it")
+        self.assertEqual(candidate.user_message_count, 1)
+        self.assertEqual(mock_reply.call_args.args[0].pk, candidate.pk)
+
+    @patch("onboarding.views.BG_POOL.submit")
+    @patch("onboarding.views.send_text_message")
+    @patch("onboarding.views.orchestrated_reply")
+    def test_streamed_reply_is_sent_once(self, mock_reply, mock_send, mock_submit):
+        def reply(candidate, msg, lang, on_reply):
+            on_reply("Vai su Documenti.")
+            return "Vai su Documenti.", None
+
+        mock_reply.side_effect = reply
+        candidate = Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000046")
+
+        views.process_webhook_message("393330000046", "Come carico il documento?")
+
+        mock_send.assert_called_once_with("393330000046", "Vai su Documenti.")
+        self.assertEqual(candidate.latest_text("bot"), "Vai su Documenti.")
+
+    @patch("onboarding.views.BG_POOL.submit")
+    @patch("onboarding.views.send_text_message", side_effect=[requests.ConnectionError("meta down"), {}])
+    @patch("onboarding.views.client.chat.completions.create")
+    def test_undelivered_streamed_send_is_retried_after_the_turn(self, mock_create, mock_send, mock_submit):
+        mock_create.return_value = OrchestratedReplyTests.stream_of(
+            '{"reply": "Vai su Documenti."', ', "escalation": {"frustration_score": 1}}'
+        )
+        candidate = Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000041",
+                                             user_message_count=1)
+
+        with self.assertLogs("onboarding.views", level="WARNING") as logs:
+            views.process_webhook_message("393330000041", "Come carico il documento?")
+
+        self.assertEqual([c.args for c in mock_send.call_args_list],
+                         [("393330000041", "Vai su Documenti.")] * 2)
+        self.assertEqual(candidate.latest_text("bot"), "Vai su Documenti.")
+        self.assertFalse(any("GPT ERROR" in line for line in logs.output))
+        # The turn keeps the orchestrator's scores instead of the error path
+        mock_submit.assert_any_call(views.apply_escalation_scores, ANY, {"frustration_score": 1})
+
+    @patch("onboarding.views.BG_POOL.submit")
+    @patch("onboarding.views.send_text_message", side_effect=requests.Timeout("read timed out"))
+    @patch("onboarding.views.client.chat.completions.create")
+    def test_timed_out_streamed_send_is_not_repeated(self, mock_create, mock_send, mock_submit):
+        mock_create.return_value = OrchestratedReplyTests.stream_of('{"reply": "Vai su Documenti."}')
+        candidate = Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000042",
+                                             user_message_count=1)
+
+        with self.assertLogs("onboarding.views", level="ERROR") as logs:
+            views.process_webhook_message("393330000042", "Come carico il documento?")
+
+        # Meta may have delivered it: a second send could duplicate the message
+        mock_send.assert_called_once_with("393330000042", "Vai su Documenti.")
+        self.assertIn("not resending", logs.output[0])
+        self.assertEqual(candidate.latest_text("bot"), "Vai su Documenti.")
+
+    def test_only_sends_meta_never_got_are_safe_to_repeat(self):
+        throttled = requests.HTTPError(response=Mock(status_code=429))
+        bad_gateway = requests.HTTPError(response=Mock(status_code=502))
+        aborted = requests.ConnectionError(views.ProtocolError("Connection aborted."))
+
+        self.assertTrue(views.send_never_reached_meta(requests.ConnectionError("refused")))
+        self.assertTrue(views.send_never_reached_meta(throttled))
+        self.assertFalse(views.send_never_reached_meta(bad_gateway))
+        self.assertFalse(views.send_never_reached_meta(aborted))
+        self.assertFalse(views.send_never_reached_meta(requests.ReadTimeout("read timed out")))
+
+    @patch("onboarding.views.BG_POOL.submit")
+    @patch("onboarding.views.send_text_message")
+    @patch("onboarding.views.orchestrated_reply", return_value=("Ok, next step.", None))
+    def test_markerless_message_keeps_the_chat_language(self, mock_reply, mock_send, mock_submit):
+        candidate = Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000045")
+
+        views.process_webhook_message("393330000045", "Thanks, how do I sign?")
+        views.process_webhook_message("393330000045", "ok")
+
+        self.assertEqual([c.args[2] for c in mock_reply.call_args_list], ["en", "en"])
+        candidate.refresh_from_db()
+        self.assertEqual(candidate.preferred_language, "en")
+
+    @patch("onboarding.views.BG_POOL.submit")
+    @patch("onboarding.views.send_text_message")
+    @patch("onboarding.views.orchestrated_reply", return_value=("Perfetto!", None))
+    def test_markerless_first_message_is_answered_in_italian(self, mock_reply, mock_send, mock_submit):
+        views.process_webhook_message("393330000049", "👍")
+
+        self.assertEqual(mock_reply.call_args.args[2], "it")
+        candidate = Candidate.objects.get(phone_number="393330000049")
+        self.assertEqual(candidate.preferred_language, "it")
+
+    @patch("onboarding.views.BG_POOL.submit", side_effect=lambda fn, *args: fn(*args))
+    @patch("onboarding.views.send_text_message")
+    @patch("onboarding.views.send_escalation_email")
+    @patch("onboarding.views.run_background_escalation_check")
+    @patch("onboarding.views.orchestrated_reply",
+           return_value=("Ti capisco, vediamo insieme.", {"frustration_score": "8", "human_request_score": 2}))
+    def test_reply_scores_replace_the_classifier(self, mock_reply, mock_check, mock_email, mock_send, mock_submit):
+        candidate = Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000042")
+
+        views.process_webhook_message("393330000042", "Non funziona niente!!")
+
+        candidate.refresh_from_db()
+        self.assertEqual(candidate.status, "escalated")
+        self.assertEqual(candidate.escalation_reason, "Escalated (F:8, H:2, C:0, R:0)")
+        self.assertFalse(mock_check.called)
+
+    @patch("onboarding.views.BG_POOL.submit")
+    @patch("onboarding.views.send_text_message")
+    @patch("onboarding.views.send_escalation_email")
+    def test_immediate_escalation_mails_in_background(self, mock_email, mock_send, mock_submit):
+        candidate = Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000041")
+
+        views.process_webhook_message("393330000041", "Voglio parlare con un operatore")
+
+        candidate.refresh_from_db()
+        self.assertEqual(candidate.status, "escalated")
+        self.assertEqual(candidate.user_message_count, 1)
+        self.assertFalse(mock_email.called)
+        mock_submit.assert_called_once_with(mock_email, candidate)
+        self.assertTrue(mock_send.call_args.args[1].startswith("Ti metto in contatto"))
+
+
+class BackgroundPoolTests(TestCase):
+    def test_failed_background_task_is_logged(self):
+        def broken():
+            raise RuntimeError("db is locked")
+
+        with self.assertLogs("onboarding.views", level="ERROR") as logs:
+            logged = threading.Event()
+            future = views.BG_POOL.submit(broken)
+            # Callbacks run in order, so this one fires after the pool's own
+            future.add_done_callback(lambda f: logged.set())
+            self.assertTrue(logged.wait(5))
+
+        self.assertIn("Background task broken failed", logs.output[0])
+
+
+class ResumeBotTests(TestCase):
+    def test_resume_trims_chat_turns_but_keeps_bot_memory(self):
+        candidate = Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000048",
+                                             status="escalated")
+        candidate.append_history(
+            {"from": "summary", "text": "- vuole firmare"},
+            *[{"from": "user", "text": f"msg {i}"} for i in range(5)],
+            {"from": "state", "text": '{"step": "firma"}'},
+        )
+
+        self.client.post("/resume_bot/", data=json.dumps({"phone_number": "393330000048"}),
+                         content_type="application/json")
+
+        self.assertEqual([m["text"] for m in candidate.history_entries()],
+                         ["- vuole firmare", "msg 2", "msg 3", "msg 4", '{"step": "firma"}'])
+        self.assertEqual(Candidate.objects.get(pk=candidate.pk).status, "replied")
+
+
+class GraphSessionTests(TestCase):
+    def test_message_posts_are_not_retried_after_meta_may_have_sent_them(self):
+        retry = views.SESSION.get_adapter(views.GRAPH_MESSAGES_URL).max_retries
+        self.assertEqual(retry.read, 0)
+        self.assertEqual(list(retry.status_forcelist), [429])
+        self.assertTrue(retry.is_retry("POST", 429))
+        self.assertFalse(retry.is_retry("POST", 502))
+
+
+class AdminReplyTests(TestCase):
+    def post_reply(self, phone):
+        return self.client.post("/send_admin_reply/", data=json.dumps({"phone_number": phone,
+                                                                      "text": "Ti aiuto io."}),
+                                content_type="application/json")
+
+    @patch("onboarding.views.send_text_message")
+    def test_reply_is_sent_and_recorded(self, mock_send):
+        candidate = Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000044")
+
+        response = self.post_reply("393330000044")
+
+        self.assertEqual(response.json(), {"sent": True})
+        self.assertEqual(candidate.history_entries(), [{"from": "admin", "text": "Ti aiuto io."}])
+        mock_send.assert_called_once_with("393330000044", "Ti aiuto io.")
+
+    @patch("onboarding.views.send_text_message", side_effect=ConnectionError("meta down"))
+    def test_failed_send_is_reported_and_not_recorded(self, mock_send):
+        candidate = Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000048")
+
+        with self.assertLogs("onboarding.views", level="ERROR"):
+            response = self.post_reply("393330000048")
+
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(response.json()["sent"], False)
+        self.assertEqual(candidate.history_entries(), [])
+
+    @patch("onboarding.views.send_text_message")
+    def test_unknown_candidate_is_a_404(self, mock_send):
+        response = self.post_reply("393330000049")
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()["sent"], False)
+        self.assertFalse(mock_send.called)
+
+
+class SenderLockTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_second_message_waits_for_the_first(self):
+        first = views.acquire_sender_lock("393330000050")
+        acquired = threading.Event()
+        second_token = []
+
+        def second():
+            second_token.append(views.acquire_sender_lock("393330000050"))
+            acquired.set()
+
+        worker = threading.Thread(target=second)
+        worker.start()
+        self.assertFalse(acquired.wait(0.5))
+
+        views.release_sender_lock("393330000050", first)
+        self.assertTrue(acquired.wait(2))
+        worker.join()
+        self.assertIsNotNone(second_token[0])
+        views.release_sender_lock("393330000050", second_token[0])
+
+    @patch("onboarding.views.SENDER_LOCK_TTL", 0.3)
+    def test_stuck_lock_is_given_up_after_the_ttl(self):
+        cache.add("whlock:393330000051", "other", 60)
+        started = views.time.monotonic()
+        self.assertIsNone(views.acquire_sender_lock("393330000051"))
+        self.assertLess(views.time.monotonic() - started, 2)
+
+    def test_release_leaves_another_holders_lock_alone(self):
+        stale = views.acquire_sender_lock("393330000052")
+        # The TTL ran out and another worker took the lock meanwhile
+        cache.set("whlock:393330000052", "other", 60)
+
+        views.release_sender_lock("393330000052", stale)
+        views.release_sender_lock("393330000052", None)
+
+        self.assertEqual(cache.get("whlock:393330000052"), "other")
 
 
 class SendOnboardingTemplateTests(TestCase):
-    @patch("onboarding.views.requests.post")
+    @patch("onboarding.views.SESSION.post")
     def test_send_onboarding_template_payload(self, mock_post):
         mock_post.return_value.status_code = 200
         mock_post.return_value.text = "ok"
@@ -22,7 +856,7 @@ class SendOnboardingTemplateTests(TestCase):
 
         views.send_onboarding_template(phone, first_name, company, position)
 
-        self.assertTrue(mock_post.called, "requests.post should be called")
+        self.assertTrue(mock_post.called, "SESSION.post should be called")
         _, kwargs = mock_post.call_args
         payload = kwargs["json"]
 
@@ -42,7 +876,7 @@ class SendOnboardingTemplateTests(TestCase):
         header = payload["template"]["components"][0]["parameters"][0]
         self.assertEqual(header["document"]["filename"], "Informativa_InPlace.pdf")
 
-    @patch("onboarding.views.requests.post")
+    @patch("onboarding.views.SESSION.post")
     def test_send_onboarding_template_retries_with_expected_param_count(self, mock_post):
         error_json = {
             "error": {
@@ -88,7 +922,7 @@ class UploadExcelTemplateTests(TestCase):
     def setUp(self):
         self.client = Client()
 
-    @patch("onboarding.views.requests.post")
+    @patch("onboarding.views.SESSION.post")
     @patch("onboarding.views.pd.read_excel")
     def test_upload_excel_uses_three_variables(self, mock_read_excel, mock_post):
         mock_post.return_value.status_code = 200
@@ -121,9 +955,92 @@ class UploadExcelTemplateTests(TestCase):
         candidate = Candidate.objects.get(phone_number="393339876543")
         self.assertEqual(candidate.name, "Luca")
 
-        self.assertTrue(mock_post.called, "requests.post should be called during upload")
+        self.assertTrue(mock_post.called, "SESSION.post should be called during upload")
         _, kwargs = mock_post.call_args
         payload = kwargs["json"]
         body_params = payload["template"]["components"][1]["parameters"]
         values = [param["text"] for param in body_params]
         self.assertEqual(values, ["Luca", "Beta SRL", "Addetto Magazzino"])
+
+    @patch("onboarding.views.SESSION.post")
+    @patch("onboarding.views.pd.read_excel")
+    def test_upload_excel_skips_existing_and_duplicate_phones(self, mock_read_excel, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.text = "ok"
+        mock_post.return_value.json.return_value = {"success": True}
+
+        Candidate.objects.create(name="Anna", surname="Rossi", phone_number="393330000001", status="escalated")
+
+        mock_read_excel.return_value = pd.DataFrame([
+            {"name": "Anna", "surname": "Rossi", "phone_number": "+39 333 0000001"},
+            {"name": "Luca", "surname": "Bianchi", "phone_number": "+39 333 0000002"},
+            {"name": "Luca", "surname": "Bianchi", "phone_number": "393330000002"},
+        ])
+
+        fake_file = SimpleUploadedFile("candidates.xlsx", b"dummy")
+        response = self.client.post("/upload_excel/", {"file": fake_file})
+
+        data = response.json()
+        self.assertEqual(data.get("added"), 1)
+        self.assertEqual(data.get("skipped"), 2)
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(Candidate.objects.get(phone_number="393330000001").status, "escalated")
+        self.assertEqual(Candidate.objects.filter(phone_number="393330000002").count(), 1)
+
+    @patch("onboarding.views.SESSION.post")
+    @patch("onboarding.views.pd.read_excel")
+    def test_upload_excel_marks_failed_sends(self, mock_read_excel, mock_post):
+        ok = Mock(status_code=200, text="ok")
+        ok.json.return_value = {"success": True}
+        error = Mock(status_code=500, text="error")
+        error.raise_for_status.side_effect = Exception("500 Server Error")
+        mock_post.side_effect = lambda url, **kwargs: ok if kwargs["json"]["to"] == "393330000005" else error
+        mock_read_excel.return_value = pd.DataFrame([
+            {"name": "Anna", "surname": "Rossi", "phone_number": "393330000005"},
+            {"name": "Luca", "surname": "Bianchi", "phone_number": "393330000006"},
+        ])
+
+        response = self.client.post("/upload_excel/", {"file": SimpleUploadedFile("candidates.xlsx", b"dummy")})
+
+        data = response.json()
+        self.assertEqual(data.get("added"), 1)
+        self.assertEqual(data.get("failed"), ["393330000006"])
+        self.assertEqual(Candidate.objects.get(phone_number="393330000005").status, "sent")
+        self.assertEqual(Candidate.objects.get(phone_number="393330000006").status, "failed")
+
+    @patch("onboarding.views.EXCEL_STREAMING_THRESHOLD", 0)
+    @patch("onboarding.views.SESSION.post")
+    def test_upload_excel_streams_large_workbooks(self, mock_post):
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.text = "ok"
+        mock_post.return_value.json.return_value = {"success": True}
+
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(["name", "surname", "phone_number"])
+        ws.append(["Giulia", "Verdi", "+39 333 1112223"])
+        ws.append(["Marco", None, None])
+        buffer = io.BytesIO()
+        wb.save(buffer)
+
+        fake_file = SimpleUploadedFile("candidates.xlsx", buffer.getvalue())
+        response = self.client.post("/upload_excel/", {"file": fake_file})
+
+        data = response.json()
+        self.assertEqual(data.get("added"), 1)
+        self.assertEqual(len(data.get("failed")), 1)
+        candidate = Candidate.objects.get(phone_number="393331112223")
+        self.assertEqual(candidate.surname, "Verdi")
+
+    def test_unused_sheet_columns_are_not_read(self):
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(["name", "phone_number", "notes", "company"])
+        ws.append(["Giulia", "393331112223", "x" * 100, "Beta SRL"])
+        buffer = io.BytesIO()
+        wb.save(buffer)
+
+        for threshold in (1024 * 1024, 0):
+            with self.subTest(streamed=threshold == 0), patch("onboarding.views.EXCEL_STREAMING_THRESHOLD", threshold):
+                rows = list(views.iter_excel_rows(SimpleUploadedFile("candidates.xlsx", buffer.getvalue())))
+                self.assertEqual(rows, [{"name": "Giulia", "phone_number": "393331112223", "company": "Beta SRL"}])
@@ -1,18 +1,39 @@
 # onboarding/views.py
 
 import os
+import asyncio
+import hashlib
+import hmac
 import json
+import logging
+import random
 import re
 import requests
 import pandas as pd
+import openpyxl
+import orjson
 import threading
+import time
+import uuid
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import islice
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError
+from urllib3.util.retry import Retry
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Length
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_GET, require_POST
-from .models import Candidate
+from .models import Candidate, Message, ProcessedMessage
 
 # ==============================
 # Env / Client
@@ -23,9 +44,115 @@ VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
 ACCESS_TOKEN = os.getenv("ACCESS_TOKEN")
 PHONE_NUMBER_ID = os.getenv("PHONE_NUMBER_ID")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+APP_SECRET = os.getenv("APP_SECRET")  # optional: enables X-Hub-Signature-256 checks
+
+logger = logging.getLogger(__name__)
 
 client = OpenAI(api_key=OPENAI_API_KEY)
-print("[OPENAI] Key loaded:", bool(client.api_key))
+logger.info("[OPENAI] Key loaded: %s", bool(client.api_key))
+
+# Background GPT calls (escalation classifier) are awaited on one event loop
+# thread, so they don't each hold a pool thread for the whole round-trip
+aclient = AsyncOpenAI(api_key=OPENAI_API_KEY)
+ASYNC_LOOP = asyncio.new_event_loop()
+threading.Thread(target=ASYNC_LOOP.run_forever, name="openai-async", daemon=True).start()
+
+# Pooled HTTP session shared by every Graph API call: keeps TLS connections
+# to Meta alive. Message POSTs are not idempotent (a 502/504 or a read
+# timeout may still have delivered the text), so only attempts Meta surely
+# never processed are retried: connection failures and 429 throttling.
+# The endpoint and auth headers are built once here instead of per request.
+GRAPH_MESSAGES_URL = f"https://graph.facebook.com/v19.0/{PHONE_NUMBER_ID}/messages"
+SESSION = requests.Session()
+SESSION.headers.update({
+    "Authorization": f"Bearer {ACCESS_TOKEN}",
+    "Content-Type": "application/json",
+})
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=50,
+    pool_maxsize=50,
+    max_retries=Retry(
+        total=3,
+        connect=3,
+        read=0,
+        backoff_factor=0.3,
+        status_forcelist=[429],
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    ),
+))
+
+# Excel upload: concurrent template sends, rows per DB batch, and the file
+# size above which workbooks are streamed instead of loaded with pandas
+TEMPLATE_SEND_WORKERS = 32
+UPLOAD_CHUNK_ROWS = 5000
+EXCEL_STREAMING_THRESHOLD = 1024 * 1024
+# Sheet columns ingest_candidates reads; any other column is never loaded
+UPLOAD_COLUMNS = frozenset({
+    "name", "surname", "phone_number",
+    "company_name", "company", "nome_azienda",
+    "job_position", "job_title", "nome_posizione_lavorativa",
+})
+
+# How long a Meta message id is remembered for de-duplication: briefly in
+# the cache, and for days in ProcessedMessage (pruned every N new ids)
+MESSAGE_ID_TTL = 5 * 60
+PROCESSED_MESSAGE_RETENTION = timedelta(days=7)
+PROCESSED_MESSAGE_PRUNE_EVERY = 500
+
+# Messages from the same phone are processed one at a time; the lock
+# expires on its own if a worker dies while holding it. It lives in the
+# Django cache, so it only spans processes if CACHES is shared (see
+# settings), and a queued message holds its WEBHOOK_POOL thread while it
+# polls, for at most SENDER_LOCK_TTL
+SENDER_LOCK_TTL = 20
+SENDER_LOCK_POLL = 0.2
+
+# How long identical escalation-classifier windows reuse their scores
+ESCALATION_CACHE_TTL = 30 * 60
+# Hard deadline for one classifier check, SDK retries included; a slow
+# check is dropped (no escalation) rather than left hanging on ASYNC_LOOP
+CLASSIFIER_DEADLINE = 8
+# Classifier calls in flight at once on ASYNC_LOOP; a burst of webhooks
+# queues for a slot (inside the deadline) instead of all hitting the API
+CLASSIFIER_CONCURRENCY = 20
+CLASSIFIER_SLOTS = asyncio.Semaphore(CLASSIFIER_CONCURRENCY)
+
+# How long GPT answers to a candidate's very first question are shared
+FIRST_REPLY_CACHE_TTL = 60 * 60
+
+# Admin panel polling endpoints: responses are cached briefly and dropped
+# by invalidate_admin_cache() whenever a chat or candidate status changes
+ADMIN_CACHE_TTL = 30
+REPORT_STATS_CACHE_TTL = 60
+ESCALATED_CACHE_KEY = "escalated_v1"
+ALL_CHATS_CACHE_KEY = "all_chats_v1"
+REPORT_STATS_CACHE_KEY = "report_stats_v1"
+
+def _log_failure(task_name: str, future):
+    """Done-callback for fire-and-forget work: nobody reads the future, so log its error."""
+    if future.cancelled():
+        return
+    exc = future.exception()
+    if exc is not None:
+        logger.error("[ERROR] Background task %s failed: %r", task_name, exc, exc_info=exc)
+
+
+class LoggedThreadPool(ThreadPoolExecutor):
+    """ThreadPoolExecutor whose submissions log any exception they end with."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = super().submit(fn, *args, **kwargs)
+        future.add_done_callback(partial(_log_failure, getattr(fn, "__name__", repr(fn))))
+        return future
+
+
+# Bounded worker pools: inbound webhook processing (Meta + GPT I/O) and
+# follow-up work that must not hold up a reply (classifier, summaries, state)
+WEBHOOK_POOL = LoggedThreadPool(max_workers=32, thread_name_prefix="wh")
+BG_POOL = LoggedThreadPool(max_workers=8, thread_name_prefix="bg")
+# Upload template sends; shared so concurrent uploads don't multiply threads
+TEMPLATE_POOL = ThreadPoolExecutor(max_workers=TEMPLATE_SEND_WORKERS, thread_name_prefix="tpl")
 
 # Swap models here if needed
 MAIN_MODEL = os.getenv("MAIN_MODEL", "gpt-4o")       # "gpt-4o" is faster than gpt-5
@@ -33,46 +160,85 @@ CLASSIFIER_MODEL = os.getenv("CLASSIFIER_MODEL", "gpt-4o-mini")  # cheap classif
 
 with open("onboarding/data/inplace_onboarding.txt", "r", encoding="utf-8") as f:
     onboarding_data = f.read()
+# Short content hash of the knowledge base; part of every cache key whose
+# value was generated from it, so editing the file invalidates them
+KB_VERSION = hashlib.sha1(onboarding_data.encode()).hexdigest()[:8]
 
 # ==============================
 # Utilities (Lang, HTTP, Params)
 # ==============================
 
-def detect_language(text: str) -> str:
+# Compiled once: these run on every inbound message / uploaded row
+_PARAM_MISMATCH_RE = re.compile(
+    r"localizable_params\s*\((\d+)\)\s*does not match the expected number of params\s*\((\d+)\)",
+    re.IGNORECASE,
+)
+_PHONE_RE = re.compile(r"\D+")
+# Usual phone separators, deleted in one C-level pass before falling back to the regex
+_PHONE_SEPARATORS = str.maketrans("", "", "+ -()./")
+
+
+def normalize_phone(raw) -> str:
+    """Keep digits only ("+39 333 123" -> "39333123"). Excel numeric cells arrive as floats."""
+    if isinstance(raw, str):
+        if raw.isdigit():
+            return raw
+        stripped = raw.translate(_PHONE_SEPARATORS)
+        if stripped.isdigit():
+            return stripped
+        return _PHONE_RE.sub("", raw)
+    if isinstance(raw, float):
+        if raw != raw:  # NaN cell
+            return ""
+        if raw.is_integer():
+            raw = int(raw)
+    elif raw is None or raw is pd.NA:
+        return ""
+    return _PHONE_RE.sub("", str(raw))
+
+
+_IT_MARKERS = frozenset({
+    "ciao", "grazie", "buongiorno", "buonasera", "buonanotte", "salve",
+    "nome", "cognome", "documento", "firma", "codice", "come", "cosa",
+    "residenza", "comune", "registrati", "verifica", "email", "italiano",
+    "esempio", "posso", "aiuto", "piacere", "scusa", "prego", "certo"
+})
+_EN_MARKERS = frozenset({
+    "hello", "hi", "hey", "thanks", "thank", "name", "surname", "document",
+    "signature", "code", "how", "what", "where", "register", "verify", "email",
+    "english", "example", "can", "help", "please", "sorry", "sure", "yes", "no"
+})
+# Multi-word English openers can't be matched token by token
+_EN_PHRASES = ("good morning", "good evening", "good night")
+# Italian function words that strongly hint at Italian on their own
+_IT_FUNCTION_WORDS = frozenset({"perché", "che", "del", "della", "gli", "le"})
+_ACCENTS = frozenset("àèéìòù")
+_WORD_RE = re.compile(r"[a-zàèéìòù]+")
+
+
+@lru_cache(maxsize=4096)
+def detect_language(text: str, default: str = "en") -> str:
     """
     Improved language detection for EN/IT and other languages.
-    Uses better heuristics and returns detected language or 'en' as fallback.
+    Scores whole-word marker hits per language (so "name" no longer matches
+    inside "surname") and returns detected language, or `default` when the
+    text has no markers at all ("ok", "👍", a document number).
     """
     if not text:
-        return "en"
-    
+        return default
+
     t = text.strip().lower()
-    
-    # Italian markers
-    it_markers = [
-        "ciao", "grazie", "buongiorno", "buonasera", "buonanotte", "salve",
-        "nome", "cognome", "documento", "firma", "codice", "come", "cosa",
-        "residenza", "comune", "registrati", "verifica", "email", "italiano",
-        "esempio", "posso", "aiuto", "piacere", "scusa", "prego", "certo"
-    ]
-    
-    # English markers
-    en_markers = [
-        "hello", "hi", "hey", "thanks", "thank", "good morning", "good evening",
-        "good night", "name", "surname", "document", "signature", "code",
-        "how", "what", "where", "register", "verify", "email", "english",
-        "example", "can", "help", "please", "sorry", "sure", "yes", "no"
-    ]
-    
+    tokens = frozenset(_WORD_RE.findall(t))
+
     # Calculate marker presence
-    it_score = sum(1 for marker in it_markers if marker in t)
-    en_score = sum(1 for marker in en_markers if marker in t)
-    
-    # Check for specific Italian patterns
-    it_patterns = ["è", "è", "à", "é", "ù", "ò", "perché", "che", "del", "della", "gli", "le"]
-    if any(pattern in t for pattern in it_patterns):
+    it_score = len(tokens & _IT_MARKERS)
+    en_score = len(tokens & _EN_MARKERS) + sum(1 for phrase in _EN_PHRASES if phrase in t)
+
+    # Accented letters or Italian function words
+    has_accents = not _ACCENTS.isdisjoint(t)
+    if has_accents or tokens & _IT_FUNCTION_WORDS:
         it_score += 2
-    
+
     # Determine language
     if it_score > en_score and it_score > 0:
         return "it"
@@ -80,39 +246,72 @@ def detect_language(text: str) -> str:
         return "en"
     elif it_score == en_score and it_score > 0:
         # If tie, check for characteristic characters
-        if any(c in t for c in "àèéìòù"):
+        if has_accents:
             return "it"
         return "en"
-    
-    # Fallback to English if no clear markers
-    return "en"
+
+    # No clear markers: keep the caller's language (English if none given)
+    return default
+
+
+class OrjsonResponse(HttpResponse):
+    """JsonResponse equivalent serialized with orjson, for the list endpoints."""
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(orjson.dumps(data), **kwargs)
+
+
+def invalidate_admin_cache():
+    """Drop the cached admin panel responses after a write they depend on."""
+    cache.delete_many([ESCALATED_CACHE_KEY, ALL_CHATS_CACHE_KEY, REPORT_STATS_CACHE_KEY])
 
 
 def send_text_message(phone_number: str, body: str):
-    url = f"https://graph.facebook.com/v19.0/{PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
     payload = {
         "messaging_product": "whatsapp",
         "to": phone_number,
         "type": "text",
         "text": {"body": body}
     }
-    r = requests.post(url, headers=headers, json=payload, timeout=10)
-    print(f"[SEND] Text -> {phone_number}: {r.status_code} {r.text}")
+    r = SESSION.post(GRAPH_MESSAGES_URL, json=payload, timeout=10)
+    logger.info("[SEND] Text -> %s: %s %s", phone_number, r.status_code, r.text)
     r.raise_for_status()
     return r.json()
 
 
-def gpt_params_for_model(model_name: str, messages, timeout: int = 8):
+def send_never_reached_meta(exc: Exception) -> bool:
+    """
+    True when a failed Graph send surely delivered nothing, so sending the
+    text again cannot duplicate it: the connection was never made, or Meta
+    answered with a 4xx (429 included). A read timeout, a dropped
+    connection or a 5xx may already have delivered the message.
+    """
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and exc.response.status_code < 500
+    if isinstance(exc, requests.ConnectionError):
+        reason = exc.args[0] if exc.args else None
+        return not isinstance(getattr(reason, "reason", reason), ProtocolError)
+    return False
+
+
+# Anti-repetition + natural variety for conversational calls; built once
+SAMPLING_PARAMS = dict(temperature=0.7, top_p=1, frequency_penalty=0.7, presence_penalty=0.3)
+
+
+def gpt_params_for_model(model_name: str, messages, timeout: int = 8, json_mode: bool = False,
+                         prompt_cache_key: str = None):
     """
     GPT-4o for speed, supports temperature/top_p/penalties.
+    json_mode asks the API for a guaranteed-parseable JSON object.
+    prompt_cache_key groups calls sharing a static prefix on one prompt cache
+    (sent raw: the pinned SDK predates the named argument).
     """
-    base = dict(model=model_name, timeout=timeout, messages=messages)
-    # Enable anti-repetition + natural variety
-    base.update(dict(temperature=0.7, top_p=1, frequency_penalty=0.7, presence_penalty=0.3))
+    base = dict(model=model_name, timeout=timeout, messages=messages, **SAMPLING_PARAMS)
+    if json_mode:
+        base["response_format"] = {"type": "json_object"}
+    if prompt_cache_key:
+        base["extra_body"] = {"prompt_cache_key": prompt_cache_key}
     return base
 
 
@@ -120,51 +319,76 @@ def gpt_params_for_model(model_name: str, messages, timeout: int = 8):
 # Lightweight memory in history
 # ==============================
 
-def get_state_objects(history):
+CHAT_ROLES = ("user", "bot", "admin")
+
+# A new summary is written once the chat since the last one reaches either
+# many turns or a token budget (estimated at ~4 chars per token)
+SUMMARY_TRIGGER_MESSAGES = 60
+SUMMARY_TRIGGER_TOKENS = 6000
+CHARS_PER_TOKEN = 4
+
+# Prompt transcript: the last turns go in verbatim, older bot/admin turns
+# are cut to a one-line stub (the stored history is never touched)
+RECENT_VERBATIM_TURNS = 4
+STALE_TURN_CHARS = 60
+
+
+def get_state_objects(candidate):
     """
-    Read prior 'state' and 'summary' items from history.
-    Stored as: {"from":"state","text":"{json}"}, {"from":"summary","text":"..."}
+    Read the latest 'state' and 'summary' messages of a candidate.
+    Stored as: role="state", text="{json}" and role="summary", text="..."
     Returns (last_state_dict_or_None, last_summary_str_or_None)
     """
     last_state = None
-    last_summary = None
-    if not history:
-        return None, None
-    for m in history:
-        if m.get("from") == "state":
-            try:
-                last_state = json.loads(m.get("text", "{}"))
-            except Exception:
-                pass
-        elif m.get("from") == "summary":
-            last_summary = m.get("text", "")
-    return last_state, last_summary
-
-
-def summarize_if_needed(candidate):
-    """Occasional rolling summary to keep context coherent without long histories."""
-    history = candidate.history or []
-    if len(history) < 60:
-        return
-    # Find last summary index
-    last_summary_idx = None
-    for i, m in enumerate(history):
-        if m.get("from") == "summary":
-            last_summary_idx = i
-    start = (last_summary_idx + 1) if last_summary_idx is not None else 0
-    window = [m for m in history[start:] if m.get("from") in {"user", "bot", "admin"}][-40:]
-    if not window:
-        return
-    transcript = "\n".join([f"{m['from']}: {m['text']}" for m in window])
+    state_text = candidate.latest_text("state")
+    if state_text:
+        try:
+            last_state = orjson.loads(state_text)
+        except Exception:
+            pass
+    return last_state, candidate.latest_text("summary")
+
+
+def summarize_if_needed(candidate_id, lang: str = None):
+    """
+    Occasional rolling summary to keep context coherent without long histories.
+    Runs on BG_POOL and reads the messages by candidate pk, so it never
+    works on the webhook's (possibly stale) instance.
+    `lang` is the current reply language; without it the window is detected.
+    """
+    candidate = Candidate(pk=candidate_id)
+    try:
+        messages = Message.objects.filter(candidate_id=candidate_id)
+        # Only chat messages since the last summary are summarized
+        last_summary_id = (
+            messages.filter(role="summary").order_by("-created", "-id")
+            .values_list("id", flat=True).first()
+        )
+        if last_summary_id is not None:
+            messages = messages.filter(id__gt=last_summary_id)
+        chat = messages.filter(role__in=CHAT_ROLES)
+        pending = chat.aggregate(n=Count("id"), chars=Sum(Length("text")))
+        if (pending["n"] < SUMMARY_TRIGGER_MESSAGES
+                and (pending["chars"] or 0) < SUMMARY_TRIGGER_TOKENS * CHARS_PER_TOKEN):
+            return
+        window = [
+            {"from": role, "text": text}
+            for role, text in reversed(
+                chat.order_by("-created", "-id").values_list("role", "text")[:40]
+            )
+        ]
+        if not window:
+            return
+        transcript = "\n".join([f"{m['from']}: {m['text']}" for m in window])
+        lang = lang or detect_language(transcript)
 
-    prompt = f"""
-Summarize this conversation window into 4–7 bullet points (<=120 words), preserving decisions, user preferences, and current step. Keep {'Italian' if detect_language(transcript) == 'it' else 'English'}.
+        prompt = f"""
+Summarize this conversation window into 4–7 bullet points (<=120 words), preserving decisions, user preferences, and current step. Keep {'Italian' if lang == 'it' else 'English'}.
 
 --- WINDOW ---
 {transcript}
 --- END ---
 """
-    try:
         res = client.chat.completions.create(
             **gpt_params_for_model(CLASSIFIER_MODEL, [
                 {"role": "system", "content": "You produce concise, faithful summaries."},
@@ -172,30 +396,98 @@ Summarize this conversation window into 4–7 bullet points (<=120 words), prese
             ], timeout=12)
         )
         summary = res.choices[0].message.content.strip()
-        candidate.history.append({"from": "summary", "text": summary})
-        candidate.save()
+        candidate.append_history({"from": "summary", "text": summary})
     except Exception as e:
-        print("[WARN] Summary failed:", e)
+        logger.warning("[WARN] Summary failed: %s", e)
 
 
 # ==============================
-# Orchestrated GPT Responding
+# Small talk (answered without GPT)
 # ==============================
 
-def build_dialogue_messages(candidate, user_msg: str, lang: str, is_first_inbound: bool):
-    """
-    Build messages for GPT:
-    - Persona + rules (bilingual, human-like, no repetition)
-    - Orchestrator JSON instruction
-    - Optional memory summary + last state
-    - Recent transcript
-    - First-contact guidance (if first inbound)
-    """
-    history = candidate.history or []
-    last_state, last_summary = get_state_objects(history)
-    recent = [m for m in history if m.get("from") in {"user", "bot", "admin"}][-6:]
+# Whole-message greetings / thanks / goodbyes. Checked in this order so
+# "ciao ciao" is a goodbye rather than a greeting. Bare "ok" is left to GPT
+# because it usually needs the next step of the flow.
+SMALLTALK_PATTERNS = {
+    "thanks": ["grazie", "grazie mille", "grazie tante", "thanks", "thank you", "thanks a lot", "thx"],
+    "goodbye": ["ciao ciao", "arrivederci", "a presto", "buona giornata", "bye", "goodbye", "see you"],
+    "greeting": ["ciao", "salve", "buongiorno", "buonasera", "hi", "hello", "hey", "good morning", "good evening"],
+}
+# One anchored alternation with a named group per intent: a single regex
+# pass per message, and the matching group's name is the intent. Longer
+# keywords go first so "thanks a lot" is tried before "thanks".
+SMALLTALK_RE = re.compile(
+    r"^\s*(?:"
+    + "|".join(
+        f"(?P<{intent}>" + "|".join(re.escape(kw) for kw in sorted(keywords, key=len, reverse=True)) + ")"
+        for intent, keywords in SMALLTALK_PATTERNS.items()
+    )
+    + r")[\s!.,?😊🙂👋🙏]*$",
+    re.IGNORECASE,
+)
+
+FIRST_WELCOME = {
+    "it": "Ciao{name}! Sono l’assistente InPlace per l’onboarding: ti aiuto con registrazione, documenti, firma digitale e accessi. Da dove vuoi iniziare?",
+    "en": "Hi{name}! I’m the InPlace onboarding assistant: I can help with registration, documents, digital signature and access. Where would you like to start?",
+}
+SMALLTALK_RESPONSES = {
+    "it": {
+        "greeting": [
+            "Ciao{name}! Dimmi pure, a che punto sei con l’onboarding?",
+            "Ciao{name}! Su cosa ti serve una mano: registrazione, documenti o firma?",
+        ],
+        "thanks": [
+            "Figurati! Se ti serve altro per l’onboarding, scrivimi pure.",
+            "Di niente! Quando vuoi passiamo al prossimo step.",
+        ],
+        "goodbye": [
+            "A presto{name}! Scrivimi quando vuoi riprendere l’onboarding.",
+            "Buona giornata! Sono qui se ti serve aiuto.",
+        ],
+    },
+    "en": {
+        "greeting": [
+            "Hi{name}! Tell me, where are you at with your onboarding?",
+            "Hi{name}! What do you need a hand with: registration, documents or signature?",
+        ],
+        "thanks": [
+            "You’re welcome! Message me anytime you need help with onboarding.",
+            "Happy to help! Let me know when you want to move to the next step.",
+        ],
+        "goodbye": [
+            "See you soon{name}! Message me whenever you want to continue.",
+            "Have a great day! I’m here if you need anything.",
+        ],
+    },
+}
+
+
+def match_smalltalk(text: str):
+    """Return the small-talk intent if the whole message is a greeting/thanks/goodbye."""
+    if not text or len(text) > 40:
+        return None
+    match = SMALLTALK_RE.match(text)
+    return match.lastgroup if match else None
+
+
+def smalltalk_reply(candidate, intent: str, lang: str, is_first_inbound: bool) -> str:
+    """Canned reply for a small-talk intent, avoiding the previous bot message."""
+    name = candidate.name if candidate.name and candidate.name != "Unknown" else ""
+    name = f" {name}" if name else ""
+    if intent == "greeting" and is_first_inbound:
+        return FIRST_WELCOME[lang].format(name=name)
+
+    options = [r.format(name=name) for r in SMALLTALK_RESPONSES[lang][intent]]
+    last_bot = candidate.latest_text("bot")
+    fresh = [r for r in options if r != last_bot] or options
+    return random.choice(fresh)
+
 
-    base_style_it = """
+# ==============================
+# Orchestrated GPT Responding
+# ==============================
+
+BASE_STYLE_IT = """
 Sei un assistente per l’onboarding InPlace.it, bilingue (Italiano/English).
 Regole:
 - Riconosci la lingua del messaggio corrente e rispondi in quella lingua. Se l’utente cambia lingua, cambia anche tu.
@@ -205,7 +497,7 @@ Regole:
 - Non chiedere le stesse info due volte se già fornite.
 - Se l’utente chiede un umano, offri l’escalation. Non inventare dati.
 """
-    base_style_en = """
+BASE_STYLE_EN = """
 You are an InPlace.it onboarding assistant, bilingual (English/Italian).
 Rules:
 - Detect the language of the CURRENT message and reply in that language. If the user switches languages mid-chat, you also switch.
@@ -216,32 +508,40 @@ Rules:
 - If the user asks for a human, offer escalation. Do not fabricate facts.
 """
 
-    # First-contact guidance (works even if first msg is a question)
-    first_contact_it = """
+# First-contact guidance (works even if first msg is a question)
+FIRST_CONTACT_IT = """
 Se questo è il PRIMO messaggio dell’utente:
 - Se il messaggio è un semplice saluto o apertura (“ciao”, “buongiorno”, ecc.), rispondi con un benvenuto caldo e breve, spiega in 1 riga come puoi aiutare (onboarding InPlace: registrazione, documenti, firme, accessi) e chiedi gentilmente da dove vuole iniziare.
 - Se il messaggio è già una domanda/azione (non un saluto), vai dritto al punto: rispondi e proponi il passo successivo senza introdurre formule generiche.
 """
-    first_contact_en = """
+FIRST_CONTACT_EN = """
 If this is the user’s FIRST message:
 - If it’s a simple greeting/opener (“hi”, “hello”, etc.), reply with a warm, brief welcome, explain in 1 line how you help (InPlace onboarding: registration, docs, signatures, access) and ask politely where they want to begin.
 - If it’s already a question/action (not just a greeting), get straight to it: answer and propose the next step—no generic intros.
 """
 
-    orchestrator = f"""
+ORCHESTRATOR_TEMPLATE = """
 Output ONLY valid JSON with this schema:
 
 {{
-  "reply": "string - user-facing answer in {'Italian' if lang=='it' else 'English'}, concise, human-like",
+  "reply": "string - user-facing answer in {language}, concise, human-like",
   "intent": "string - inferred intent (greeting, registration_help, docs_help, signature_help, access_help, proceed_step, thanks, goodbye, other)",
   "next_step": "string - suggested next move (e.g., ask for doc X, confirm step Y)",
   "state_update": {{
       "step": "string|null - current onboarding step if applicable",
       "flags": {{"wants_human": false, "confused": false, "frustrated": false}},
       "notes": "string - short memory to keep context (<=200 chars)"
+  }},
+  "escalation": {{
+      "frustration_score": "int 0-10",
+      "human_request_score": "int 0-10",
+      "confusion_score": "int 0-10",
+      "repeat_count": "int 0-10 - how many times the user repeated the same problem"
   }}
 }}
 
+Escalation scores rate the whole conversation; keep them low for polite help/thanks.
+
 Behavioral rules:
 - Use current-message language; if the user switches languages, switch too automatically.
 - Never claim you can help only in one language—you are bilingual.
@@ -249,164 +549,242 @@ Behavioral rules:
 - Avoid repetitive greetings or apologies.
 """
 
-    system_prompt = (
-        (base_style_it if lang == "it" else base_style_en)
+# Persona + knowledge base + orchestrator schema only depend on the language,
+# so each variant is assembled once at import. It is always the first message
+# and byte-identical between turns, which lets OpenAI's prefix cache reuse it;
+# everything per-candidate comes after it.
+SYSTEM_PROMPTS = {
+    lang: (
+        (BASE_STYLE_IT if lang == "it" else BASE_STYLE_EN)
         + "\n"
-        + (first_contact_it if lang == "it" else first_contact_en)
+        + (FIRST_CONTACT_IT if lang == "it" else FIRST_CONTACT_EN)
         + "\n\nKnowledge base:\n"
         + onboarding_data
+        + "\n"
+        + ORCHESTRATOR_TEMPLATE.format(language=language)
+    )
+    for lang, language in (("it", "Italian"), ("en", "English"))
+}
+
+
+# Every orchestrator call prefills the whole prefix; its estimated size is
+# logged at startup, with a warning once the KB outgrows the budget
+SYSTEM_PROMPT_TOKEN_BUDGET = 6000
+SYSTEM_PROMPT_TOKENS = {lang: len(prompt) // CHARS_PER_TOKEN for lang, prompt in SYSTEM_PROMPTS.items()}
+logger.info("[PROMPT] Static system prompt ~%s tokens (KB %s)", SYSTEM_PROMPT_TOKENS, KB_VERSION)
+if max(SYSTEM_PROMPT_TOKENS.values()) > SYSTEM_PROMPT_TOKEN_BUDGET:
+    logger.warning(
+        "[WARN] Static system prompt exceeds ~%s tokens; consider trimming inplace_onboarding.txt",
+        SYSTEM_PROMPT_TOKEN_BUDGET,
     )
 
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "system", "content": orchestrator}
-    ]
+# The FIRST_CONTACT message is one of two fixed dicts (the client only reads them)
+FIRST_CONTACT_FLAGS = {
+    True: {"role": "system", "content": "FIRST_CONTACT: true"},
+    False: {"role": "system", "content": "FIRST_CONTACT: false"},
+}
+
+
+def transcript_lines(entries):
+    """'role: text' lines; bot/admin turns before the verbatim tail are stubbed."""
+    stale = len(entries) - RECENT_VERBATIM_TURNS
+    for i, m in enumerate(entries):
+        text = m['text']
+        if i < stale and m['from'] != "user" and len(text) > STALE_TURN_CHARS:
+            text = f"{text[:STALE_TURN_CHARS].replace(chr(10), ' ')}… ({len(text)}c)"
+        yield f"{m['from']}: {text}"
+
+
+def build_dialogue_messages(candidate, user_msg: str, lang: str, is_first_inbound: bool):
+    """
+    Build messages for GPT:
+    - Static prefix: persona + rules, knowledge base, orchestrator JSON instruction
+    - Optional memory summary + last state
+    - Recent transcript
+    - First-contact guidance (if first inbound)
+    """
+    last_state, last_summary = get_state_objects(candidate)
+    recent = candidate.history_entries(roles=CHAT_ROLES, limit=6)
+
+    messages = [{"role": "system", "content": SYSTEM_PROMPTS[lang]}]
 
     if last_summary:
         messages.append({"role": "system", "content": f"Conversation summary so far:\n{last_summary}"})
     if last_state:
-        messages.append({"role": "system", "content": f"State memory:\n{json.dumps(last_state, ensure_ascii=False)}"})
+        messages.append({"role": "system", "content": f"State memory:\n{orjson.dumps(last_state).decode()}"})
     if recent:
-        transcript = "\n".join([f"{m['from']}: {m['text']}" for m in recent])
+        transcript = "\n".join(transcript_lines(recent))
         messages.append({"role": "system", "content": f"Recent transcript:\n{transcript}"})
 
     # Explicit first-contact flag helps the model choose tone without being generic
-    if is_first_inbound:
-        messages.append({"role": "system", "content": "FIRST_CONTACT: true"})
-    else:
-        messages.append({"role": "system", "content": "FIRST_CONTACT: false"})
+    messages.append(FIRST_CONTACT_FLAGS[is_first_inbound])
 
     messages.append({"role": "user", "content": user_msg})
     return messages
 
 
-def orchestrated_reply(candidate, incoming_msg: str):
+def _looks_like_json(text: str) -> bool:
+    return text[:1] == "{" and text[-1:] == "}"
+
+
+def normalize_reply(reply, lang: str) -> str:
     """
-    One GPT call that returns a JSON with reply + state and saves state in history.
-    Language is selected from the CURRENT message so we can switch mid-chat.
+    Turn the orchestrator's "reply" field into sendable text.
+    Objects/lists are never sent; a reply that is itself an orchestrator JSON
+    is unwrapped once (single decode), anything else falls back to "Ok.".
     """
-    history = candidate.history or []
-    # first user message if count of user entries == 1 after appending
-    user_msgs = [m for m in history if m.get("from") == "user"]
-    is_first_inbound = len(user_msgs) == 1
-    lang = detect_language(incoming_msg)
+    fallback = "Ok." if lang == "en" else "Ok."
+    if isinstance(reply, (dict, list)):
+        logger.warning("[WARN] Reply field is not text, using fallback")
+        return fallback
+    reply = "" if reply is None else str(reply).strip()
+
+    if _looks_like_json(reply):
+        try:
+            inner = orjson.loads(reply).get("reply")
+        except Exception:
+            inner = None
+        inner = inner.strip() if isinstance(inner, str) else ""
+        if not inner or _looks_like_json(inner):
+            logger.warning("[WARN] Reply looks like JSON, using fallback")
+            return fallback
+        reply = inner
 
-    messages = build_dialogue_messages(candidate, incoming_msg, lang, is_first_inbound)
+    return reply or fallback
 
-    try:
-        res = client.chat.completions.create(
-            **gpt_params_for_model(MAIN_MODEL, messages, timeout=8)
-        )
-        raw = res.choices[0].message.content.strip()
-        print("[DEBUG] Orchestrator raw response:", raw)
-
-        # Clean markdown code blocks if present (GPT sometimes wraps JSON in ```json ... ```)
-        cleaned = raw
-        # More robust markdown code fence removal
-        if "```" in cleaned:
-            # Remove opening code fence (```json, ```, etc.) - handle with or without language identifier
-            cleaned = re.sub(r'^```\w*\s*\n?', '', cleaned, flags=re.MULTILINE)
-            # Remove closing code fence
-            cleaned = re.sub(r'\n?```\s*$', '', cleaned, flags=re.MULTILINE)
-            cleaned = cleaned.strip()
 
-        try:
-            data = json.loads(cleaned)
-        except json.JSONDecodeError as e:
-            print(f"[WARN] JSON parse error: {e}, using fallback")
-            # If parsing fails, treat the entire response as the reply (don't send raw JSON)
-            # Extract any text that looks like a natural language response
-            if cleaned.startswith("{") and cleaned.endswith("}"):
-                # It's JSON but malformed - try to extract reply manually
+def first_reply_cache_key(lang: str, incoming_msg: str) -> str:
+    normalized = " ".join(incoming_msg.lower().split())
+    return "firstreply:" + hashlib.sha256(f"{MAIN_MODEL}|{KB_VERSION}|{lang}|{normalized}".encode()).hexdigest()
+
+
+# The orchestrator JSON leads with "reply"; once that string is closed it can
+# be sent while the model is still writing intent, state and scores
+_REPLY_FIELD_RE = re.compile(r'\s*\{\s*"reply"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def stream_orchestrator(params: dict, on_text) -> str:
+    """
+    Run the orchestrator call streamed and return the full raw output.
+    on_text(reply) is called once, as soon as a leading "reply" string is
+    complete; output in any other key order is only returned.
+    """
+    raw = ""
+    pending = True
+    for chunk in client.chat.completions.create(**params, stream=True):
+        if not chunk.choices:
+            continue
+        raw += chunk.choices[0].delta.content or ""
+        if pending:
+            match = _REPLY_FIELD_RE.match(raw)
+            if match:
+                pending = False
                 try:
-                    # Try to extract reply field from JSON string manually
-                    # Look for "reply": "..." pattern, handling escaped quotes and multiline strings
-                    # This regex handles: "reply": "text" or "reply":"text" with escaped quotes
-                    # Also handles multiline strings with proper escaping
-                    match = re.search(r'"reply"\s*:\s*"((?:[^"\\]|\\.)*)"', cleaned, re.DOTALL)
-                    if match:
-                        reply_text = match.group(1).replace('\\"', '"').replace('\\n', '\n').replace('\\\\', '\\')
-                    else:
-                        # Last resort: return a generic message instead of raw JSON
-                        reply_text = "Ok." if lang == "en" else "Ok."
-                    data = {"reply": reply_text, "state_update": None, "intent": "other", "next_step": ""}
-                except Exception:
-                    data = {"reply": "Ok." if lang == "en" else "Ok.", "state_update": None, "intent": "other", "next_step": ""}
-            else:
-                # Not JSON, use as-is
-                data = {"reply": cleaned, "state_update": None, "intent": "other", "next_step": ""}
-
-        # Extract reply field - ensure it's always a string, never raw JSON
-        reply = data.get("reply")
-        # Handle None, empty string, or other falsy values
-        if reply is None or reply == "":
-            reply = ""
-        elif isinstance(reply, dict):
-            # If reply is accidentally a dict/object, don't send it - use fallback
-            print("[WARN] Reply field is a dict, using fallback")
-            reply = ""
-        elif isinstance(reply, list):
-            # If reply is a list, don't send it - use fallback
-            print("[WARN] Reply field is a list, using fallback")
-            reply = ""
-        elif not isinstance(reply, str):
-            # Convert other types to string, but check if it looks like JSON first
-            reply_str = str(reply)
-            if reply_str.startswith("{") and reply_str.endswith("}"):
-                print("[WARN] Reply field converted to string but looks like JSON, using fallback")
-                reply = ""
+                    text = orjson.loads(f'"{match.group(1)}"')
+                except orjson.JSONDecodeError:
+                    continue  # left to the full parse once the stream ends
+                on_text(text)
+    return raw.strip()
+
+
+def orchestrated_reply(candidate, incoming_msg: str, lang: str = None, on_reply=None):
+    """
+    One GPT call that returns a JSON with reply + state + escalation scores,
+    and saves state in history. Returns (reply, escalation_scores_or_None).
+    Language is selected from the CURRENT message so we can switch mid-chat
+    (callers that already detected it pass `lang`).
+    With on_reply, the GPT answer is streamed and on_reply(reply) is called
+    as soon as the reply text is complete, before the rest of the JSON.
+    """
+    # first user message if this is the candidate's first inbound turn
+    is_first_inbound = candidate.user_message_count == 1
+    lang = lang or detect_language(incoming_msg, candidate.preferred_language)
+
+    # Plain greetings / thanks / goodbyes don't need a GPT round-trip
+    intent = match_smalltalk(incoming_msg)
+    if intent:
+        return smalltalk_reply(candidate, intent, lang, is_first_inbound), None
+
+    # A first message has no summary, state or earlier turns, so the prompt
+    # is just (lang, message): the same opening question from another
+    # candidate can reuse that GPT answer
+    cache_key = first_reply_cache_key(lang, incoming_msg) if is_first_inbound else None
+    data = cache.get(cache_key) if cache_key else None
+
+    # The streamed reply, once on_reply has taken it, is final for this turn.
+    # If on_reply fails the stream carries on and the caller gets the reply
+    # as if it had not been streamed; that is not a GPT error.
+    sent = []
+
+    def emit(text):
+        reply = normalize_reply(text, lang)
+        try:
+            on_reply(reply)
+        except Exception as e:
+            logger.warning("[WARN] Streamed reply not delivered: %s", e)
+            return
+        sent.append(reply)
+
+    try:
+        if data is None:
+            messages = build_dialogue_messages(candidate, incoming_msg, lang, is_first_inbound)
+            params = gpt_params_for_model(MAIN_MODEL, messages, timeout=8, json_mode=True,
+                                          prompt_cache_key=f"onboarding_{lang}_{KB_VERSION}")
+            if on_reply:
+                raw = stream_orchestrator(params, emit)
             else:
-                reply = reply_str
-        
-        reply = reply.strip() if reply else ""
-        
-        # Final safety check: if reply looks like JSON (starts with { and ends with }), don't send it
-        # Also check for orchestrator JSON structure markers to catch the full response being sent
-        is_orchestrator_json = (
-            reply.startswith("{") and reply.endswith("}") and
-            ("\"intent\"" in reply or "\"next_step\"" in reply or "\"state_update\"" in reply)
-        )
-        
-        if reply.startswith("{") and reply.endswith("}"):
+                res = client.chat.completions.create(**params)
+                raw = res.choices[0].message.content.strip()
+            logger.debug("[DEBUG] Orchestrator raw response: %s", raw)
+
+            # JSON mode guarantees an object; only a truncated reply fails to
+            # parse, and normalize_reply turns its missing "reply" into a fallback
             try:
-                # Try to parse it and extract meaningful text
-                parsed_json = json.loads(reply)
-                # If it's the full orchestrator response structure, extract the reply field again
-                if "reply" in parsed_json and isinstance(parsed_json["reply"], str):
-                    extracted_reply = parsed_json["reply"].strip()
-                    # Make sure the extracted reply isn't also JSON
-                    if extracted_reply and not (extracted_reply.startswith("{") and extracted_reply.endswith("}")):
-                        reply = extracted_reply
-                    else:
-                        # Extracted reply is also JSON - use fallback
-                        print("[WARN] Extracted reply is also JSON, using fallback")
-                        reply = "Ok." if lang == "en" else "Ok."
-                else:
-                    # If no valid reply field, use a generic message
-                    print("[WARN] No valid reply field in JSON structure, using fallback")
-                    reply = "Ok." if lang == "en" else "Ok."
-            except Exception:
-                # If it's not valid JSON or can't extract, use fallback
-                print("[WARN] Could not parse JSON in final safety check, using fallback")
-                reply = "Ok." if lang == "en" else "Ok."
-        
-        if not reply:
-            reply = "Ok." if lang == "en" else "Ok."
+                data = orjson.loads(raw)
+            except orjson.JSONDecodeError as e:
+                logger.warning("[WARN] JSON parse error: %s, using fallback", e)
+                data = None
+            if isinstance(data, dict):
+                if cache_key:
+                    cache.set(cache_key, data, FIRST_REPLY_CACHE_TTL)
+            else:
+                data = {}
+        else:
+            logger.info("[INFO] First-contact reply served from cache")
+
+        # Ensure the reply is always plain text, never raw JSON
+        reply = sent[0] if sent else normalize_reply(data.get("reply"), lang)
 
-        # Persist state
+        # Persist state (off the request path, the reply does not depend on it)
         su = data.get("state_update")
         if su:
-            try:
-                candidate.history.append({"from": "state", "text": json.dumps(su, ensure_ascii=False)})
-                candidate.save()
-            except Exception as e:
-                print("[WARN] Failed to save state:", e)
+            BG_POOL.submit(persist_state, candidate.pk, su)
+
+        scores = data.get("escalation")
+        return reply, scores if isinstance(scores, dict) else None
+
+    except Exception as e:
+        logger.error("[GPT ERROR]: %s", e)
+        if sent:
+            # Already on its way to the user; keep it as this turn's reply
+            return sent[0], None
+        return ("Sorry, something went wrong. Please try again later." if lang == "en" else "Spiacente, si è verificato un errore. Riprova più tardi."), None
 
-        return reply
 
+def persist_state(candidate_id, state_update: dict):
+    """
+    Store the orchestrator's state_update (runs on BG_POOL).
+    Only the latest state is ever read, so it replaces the previous ones
+    instead of adding a row per turn.
+    """
+    try:
+        with transaction.atomic():
+            Message.objects.filter(candidate_id=candidate_id, role="state").delete()
+            Candidate(pk=candidate_id).append_history(
+                {"from": "state", "text": json.dumps(state_update, ensure_ascii=False)}
+            )
     except Exception as e:
-        print("[GPT ERROR]:", e)
-        return "Sorry, something went wrong. Please try again later." if lang == "en" else "Spiacente, si è verificato un errore. Riprova più tardi."
+        logger.warning("[WARN] Failed to save state: %s", e)
 
 
 # ==============================
@@ -414,8 +792,7 @@ def orchestrated_reply(candidate, incoming_msg: str):
 # ==============================
 
 def send_onboarding_template(phone_number, first_name: str, company: str, job_position: str):
-    print(f"[WHATSAPP] Sending message to: {phone_number}")
-    url = f"https://graph.facebook.com/v19.0/{PHONE_NUMBER_ID}/messages"
+    logger.info("[WHATSAPP] Sending message to: %s", phone_number)
 
     base_body_params = [
         {"parameter_name": "first_name", "text": first_name},
@@ -423,9 +800,9 @@ def send_onboarding_template(phone_number, first_name: str, company: str, job_po
 
     def build_payload(param_count: int, *, use_names: bool = True):
         if param_count > len(base_body_params):
-            print(
-                f"[WARN] Template expects {param_count} parameters but only {len(base_body_params)} provided. "
-                "Using available values."
+            logger.warning(
+                "[WARN] Template expects %s parameters but only %s provided. Using available values.",
+                param_count, len(base_body_params),
             )
 
         selected_params = base_body_params[:max(0, param_count)]
@@ -464,14 +841,9 @@ def send_onboarding_template(phone_number, first_name: str, company: str, job_po
             },
         }
 
-    headers = {
-        "Authorization": f"Bearer {ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-
     payload = build_payload(1)
-    response = requests.post(url, headers=headers, json=payload)
-    print(f"[META] Response: {response.status_code} {response.text}")
+    response = SESSION.post(GRAPH_MESSAGES_URL, json=payload, timeout=10)
+    logger.info("[META] Response: %s %s", response.status_code, response.text)
 
     if response.status_code == 400:
         fallback_count = None
@@ -482,29 +854,25 @@ def send_onboarding_template(phone_number, first_name: str, company: str, job_po
                 .get("error_data", {})
                 .get("details", "")
             )
-            match = re.search(
-                r"localizable_params\s*\((\d+)\)\s*does not match the expected number of params\s*\((\d+)\)",
-                details,
-                flags=re.IGNORECASE,
-            )
+            match = _PARAM_MISMATCH_RE.search(details)
             if match:
                 received, expected = match.groups()
                 received_count = int(received)
                 expected_count = int(expected)
                 if expected_count >= 0 and expected_count != received_count:
                     fallback_count = expected_count
-                    print(
-                        f"[WARN] Template expects {expected_count} parameter(s); retrying with trimmed payload."
+                    logger.warning(
+                        "[WARN] Template expects %s parameter(s); retrying with trimmed payload.", expected_count
                     )
             else:
-                print("[WARN] Unable to parse expected parameter count from Meta error details.")
+                logger.warning("[WARN] Unable to parse expected parameter count from Meta error details.")
         except (ValueError, json.JSONDecodeError) as parse_error:
-            print(f"[WARN] Failed to parse Meta error response: {parse_error}")
+            logger.warning("[WARN] Failed to parse Meta error response: %s", parse_error)
 
         if fallback_count is not None:
             fallback_payload = build_payload(fallback_count)
-            response = requests.post(url, headers=headers, json=fallback_payload)
-            print(f"[META] Response (retry): {response.status_code} {response.text}")
+            response = SESSION.post(GRAPH_MESSAGES_URL, json=fallback_payload, timeout=10)
+            logger.info("[META] Response (retry): %s %s", response.status_code, response.text)
 
             if response.status_code == 400:
                 try:
@@ -517,9 +885,9 @@ def send_onboarding_template(phone_number, first_name: str, company: str, job_po
                 except (ValueError, json.JSONDecodeError):
                     retry_details = response.text
 
-                print(
-                    f"[ERROR] Retry still failing for template {payload['template']['name']}: "
-                    f"{response.status_code} {retry_details}"
+                logger.error(
+                    "[ERROR] Retry still failing for template %s: %s %s",
+                    payload['template']['name'], response.status_code, retry_details,
                 )
 
     response.raise_for_status()
@@ -530,67 +898,105 @@ def send_onboarding_template(phone_number, first_name: str, company: str, job_po
 # Escalation Helpers
 # ==============================
 
+# Explicit human-request phrases (phrases only, not single words)
+ESCALATION_PHRASES_IT = [
+    "parlare con un operatore",
+    "parlare con una persona",
+    "contattare un umano",
+    "assistenza umana",
+    "voglio un operatore",
+    "voglio parlare con",
+    "posso parlare con una persona",
+    "ho bisogno di parlare con un operatore"
+]
+ESCALATION_PHRASES_EN = [
+    "speak to a human",
+    "talk to an operator",
+    "contact a person",
+    "human assistance",
+    "i need a person",
+    "real person",
+    "talk to a person",
+    "speak with an agent"
+]
+# One alternation scanned in a single pass; IGNORECASE avoids a lowercased copy.
+# The named group that matched tells which language the request was made in.
+_ESCALATION_RE = re.compile(
+    "(?P<it>" + "|".join(map(re.escape, ESCALATION_PHRASES_IT)) + ")"
+    "|(?P<en>" + "|".join(map(re.escape, ESCALATION_PHRASES_EN)) + ")",
+    re.IGNORECASE,
+)
+
+
+# Cheap pre-checks before the regex scan: a message shorter than every phrase,
+# or missing a letter all phrases share (currently "a"), can't match
+_ESCALATION_MIN_LEN = min(map(len, ESCALATION_PHRASES_IT + ESCALATION_PHRASES_EN))
+_ESCALATION_ANCHOR = min(
+    frozenset.intersection(*map(frozenset, ESCALATION_PHRASES_IT + ESCALATION_PHRASES_EN)) - {" "},
+    default=None,
+)
+
+
+def immediate_escalation_language(message: str):
+    """'it' / 'en' if the message explicitly asks for a human, else None."""
+    if len(message) < _ESCALATION_MIN_LEN:
+        return None
+    if _ESCALATION_ANCHOR and _ESCALATION_ANCHOR not in message and _ESCALATION_ANCHOR.upper() not in message:
+        return None
+    match = _ESCALATION_RE.search(message)
+    return match.lastgroup if match else None
+
+
 def check_immediate_escalation(message: str) -> bool:
     """
     Fast keyword-based escalation check for explicit human requests.
     Uses phrase matching to avoid false positives.
     """
-    msg_lower = message.lower()
-    
-    # Italian keywords - phrases only, not single words
-    it_keywords = [
-        "parlare con un operatore",
-        "parlare con una persona",
-        "contattare un umano",
-        "assistenza umana",
-        "voglio un operatore",
-        "voglio parlare con",
-        "posso parlare con una persona",
-        "ho bisogno di parlare con un operatore"
-    ]
-    
-    # English keywords - phrases only
-    en_keywords = [
-        "speak to a human",
-        "talk to an operator",
-        "contact a person",
-        "human assistance",
-        "i need a person",
-        "real person",
-        "talk to a person",
-        "speak with an agent"
-    ]
-    
-    # Check if message contains any escalation phrase
-    for phrase in it_keywords + en_keywords:
-        if phrase in msg_lower:
-            return True
-    
-    return False
-
-
-def run_background_escalation_check(candidate, incoming_msg: str):
-    """
-    Background escalation analysis using GPT.
-    Runs after reply is sent to detect frustration without blocking.
-    """
-    try:
-        if candidate.status == "escalated":
-            return
-        
-        # Only check every 3rd message to reduce API calls
-        user_messages = [m for m in candidate.history if m.get("from") == "user"]
-        should_check_escalation = len(user_messages) % 3 == 0 or len(user_messages) == 1
-        
-        if not should_check_escalation:
-            return
-        
-        chat_history = candidate.history[-5:] if candidate.history else []
-        chat_history_text = "\n".join(
-            [f"{m['from']}: {m['text']}" for m in chat_history] + [f"user: {incoming_msg}"]
-        )
-
-        classification_prompt = f"""
+    return immediate_escalation_language(message) is not None
+
+
+# Tier 2 fast path: the GPT classifier only runs when the message shows some
+# frustration / confusion signal or the user keeps repeating themselves
+FRUSTRATION_KEYWORDS = [
+    # Italian
+    "non funziona", "non va", "non capisco", "non ho capito", "ancora", "di nuovo",
+    "basta", "assurdo", "inutile", "pessimo", "vergogna", "schifo", "uffa",
+    "operatore", "umano", "persona",
+    # English
+    "not working", "doesn't work", "does not work", "don't understand", "still",
+    "again", "useless", "terrible", "ridiculous", "annoying", "wtf",
+    "operator", "human", "agent",
+]
+_FRUSTRATION_RE = re.compile(
+    r"\b(?:" + "|".join(map(re.escape, FRUSTRATION_KEYWORDS)) + r")\b|[!?]{2,}",
+    re.IGNORECASE,
+)
+# How many earlier copies of the same message in the window count as repeating
+REPEAT_THRESHOLD = 2
+# Earlier inbound turns give the classifier nothing to score; tier 1 still
+# catches explicit operator requests from the first message on
+MIN_CLASSIFIER_TURNS = 3
+
+
+def needs_classifier(incoming_msg: str, window) -> bool:
+    """True if the message or the (role, text) window is worth a GPT check."""
+    if _FRUSTRATION_RE.search(incoming_msg):
+        return True
+    # The stored window already holds this turn once; the last entry is its copy
+    msg = incoming_msg.strip().casefold()
+    copies = sum(1 for role, text in window[:-1] if role == "user" and text.strip().casefold() == msg)
+    return copies > REPEAT_THRESHOLD
+
+
+def escalation_cache_key(chat_history_text: str) -> str:
+    return "escalation:" + hashlib.sha256(
+        f"{CLASSIFIER_MODEL}|{chat_history_text}".encode()
+    ).hexdigest()
+
+
+# The instructions are a fixed prefix shared by every call, so the API's
+# prompt cache can reuse them; only the chat window (user message) varies
+CLASSIFIER_PROMPT = """
 You are an escalation analyzer for a support chatbot.
 
 Return JSON with:
@@ -600,133 +1006,299 @@ Return JSON with:
 - repeat_count (0-10)
 
 Escalate only if scores are high; do not escalate for polite help/thanks.
-
---- CHAT START ---
-{chat_history_text}
---- CHAT END ---
 """
-        result = client.chat.completions.create(
+
+
+# Structured output: the API only returns objects with exactly these four ints
+ESCALATION_SCORES_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "escalation_scores",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                key: {"type": "integer"}
+                for key in ("frustration_score", "human_request_score", "confusion_score", "repeat_count")
+            },
+            "required": ["frustration_score", "human_request_score", "confusion_score", "repeat_count"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+async def _classifier_completion(chat_history_text: str):
+    async with CLASSIFIER_SLOTS:
+        return await aclient.chat.completions.create(
             model=CLASSIFIER_MODEL,
-            messages=[{"role": "system", "content": classification_prompt}],
+            messages=[
+                {"role": "system", "content": CLASSIFIER_PROMPT},
+                {"role": "user", "content": f"--- CHAT START ---\n{chat_history_text}\n--- CHAT END ---"},
+            ],
+            response_format=ESCALATION_SCORES_FORMAT,
+            # Four small integers: deterministic, and no room for a long answer
+            temperature=0,
+            max_tokens=60,
+            # Routes every classifier call to the same prompt cache (see gpt_params_for_model)
+            extra_body={"prompt_cache_key": "escalation_v1"},
             timeout=5
         )
 
-        response_text = result.choices[0].message.content
-        scores = json.loads(response_text)
-        
-        f = scores.get("frustration_score", 0)
-        h = scores.get("human_request_score", 0)
-        c = scores.get("confusion_score", 0)
-        r = scores.get("repeat_count", 0)
-
-        if f >= 7 or h >= 8 or (c >= 8 and r >= 3):
-            escalation_reason = f"Escalated (F:{f}, H:{h}, C:{c}, R:{r})"
-            candidate.status = "escalated"
-            candidate.escalation_reason = escalation_reason
-            candidate.save()
-            send_escalation_email(candidate)
-            print(f"[ESCALATION] Background escalation: {escalation_reason}")
+
+async def classify_escalation(chat_history_text: str) -> dict:
+    """GPT escalation scores for a chat window (runs on ASYNC_LOOP)."""
+    result = await asyncio.wait_for(_classifier_completion(chat_history_text), timeout=CLASSIFIER_DEADLINE)
+
+    response_text = result.choices[0].message.content
+    return orjson.loads(response_text)
+
+
+def apply_escalation_scores(candidate, scores: dict):
+    """Escalate the candidate if the classifier scores are high."""
+    try:
+        f, h, c, r = (
+            int(scores.get(k) or 0)
+            for k in ("frustration_score", "human_request_score", "confusion_score", "repeat_count")
+        )
+    except (TypeError, ValueError):
+        logger.warning("[WARN] Ignoring malformed escalation scores: %s", scores)
+        return
+
+    if f >= 7 or h >= 8 or (c >= 8 and r >= 3):
+        escalation_reason = f"Escalated (F:{f}, H:{h}, C:{c}, R:{r})"
+        candidate.status = "escalated"
+        candidate.escalation_reason = escalation_reason
+        candidate.save(update_fields=["status", "escalation_reason", "last_updated"])
+        invalidate_admin_cache()
+        BG_POOL.submit(send_escalation_email, candidate)
+        logger.info("[ESCALATION] Background escalation: %s", escalation_reason)
+
+
+def _on_escalation_scores(candidate, cache_key: str, future):
+    """BG_POOL continuation once the classifier call on ASYNC_LOOP finishes."""
+    try:
+        scores = future.result()
+        cache.set(cache_key, scores, ESCALATION_CACHE_TTL)
+        apply_escalation_scores(candidate, scores)
+    except Exception as e:
+        logger.warning("[WARN] Background escalation check failed: %r", e)
+
+
+def run_background_escalation_check(candidate, incoming_msg: str):
+    """
+    Background escalation analysis using GPT.
+    Runs after reply is sent to detect frustration without blocking.
+    The GPT call is awaited on ASYNC_LOOP, so no BG_POOL thread waits on it;
+    identical windows (retries, repeats) reuse cached scores instead.
+    """
+    try:
+        if candidate.status == "escalated" or candidate.user_message_count < MIN_CLASSIFIER_TURNS:
+            return
+
+        # Last 5 entries as (role, text) rows, formatted straight from the tuples
+        window = list(candidate.messages.order_by('-created', '-id').values_list('role', 'text')[:5])
+        window.reverse()
+        window.append(("user", incoming_msg))
+
+        # Most turns carry no escalation signal at all; skip the API call
+        if not needs_classifier(incoming_msg, window):
+            return
+        chat_history_text = "\n".join(f"{role}: {text}" for role, text in window)
+
+        key = escalation_cache_key(chat_history_text)
+        scores = cache.get(key)
+        if scores is not None:
+            apply_escalation_scores(candidate, scores)
+            return
+
+        future = asyncio.run_coroutine_threadsafe(classify_escalation(chat_history_text), ASYNC_LOOP)
+        # Django ORM work must not run on the event loop, so hop back to BG_POOL
+        future.add_done_callback(lambda fut: BG_POOL.submit(_on_escalation_scores, candidate, key, fut))
     except Exception as e:
-        print(f"[WARN] Background escalation check failed: {e}")
+        logger.warning("[WARN] Background escalation check failed: %r", e)
 
 
 # ==============================
 # Webhook
 # ==============================
 
-def process_webhook_message(data: dict):
+def parse_inbound_message(data: dict):
+    """Return (sender_id, message_id, text) of a text message payload, else None."""
+    try:
+        value = data['entry'][0]['changes'][0]['value']
+        message = value['messages'][0]
+        return message['from'], message.get('id'), message['text']['body']
+    except (KeyError, IndexError, TypeError):
+        # Status callbacks, media messages, malformed payloads
+        return None
+
+
+def claim_message(message_id) -> bool:
+    """
+    Record a Meta message id as handled. False if it was already claimed,
+    so Meta's webhook retries never trigger a second reply.
+    """
+    if not message_id:
+        return True
+    # cache.add is SET NX with a TTL: a retry inside the window is rejected
+    # without a database round-trip (across processes with a shared cache)
+    cache_key = f"whmsg:{message_id}"
+    if not cache.add(cache_key, 1, MESSAGE_ID_TTL):
+        return False
+    try:
+        with transaction.atomic():
+            claimed = ProcessedMessage.objects.create(message_id=message_id)
+    except IntegrityError:
+        return False
+    except Exception:
+        # Not recorded: let Meta's retry through instead of dropping it as a duplicate
+        cache.delete(cache_key)
+        raise
+    # Keep the table a rolling window; pruning runs every N claims, off-request
+    if claimed.pk % PROCESSED_MESSAGE_PRUNE_EVERY == 0:
+        BG_POOL.submit(prune_processed_messages)
+    return True
+
+
+def prune_processed_messages():
+    """Forget message ids older than PROCESSED_MESSAGE_RETENTION (runs on BG_POOL)."""
+    try:
+        cutoff = timezone.now() - PROCESSED_MESSAGE_RETENTION
+        deleted, _ = ProcessedMessage.objects.filter(created__lt=cutoff).delete()
+        logger.info("[INFO] Pruned %s processed message ids", deleted)
+    except Exception as e:
+        logger.warning("[WARN] Pruning processed message ids failed: %s", e)
+
+
+def valid_signature(request) -> bool:
+    """Check Meta's X-Hub-Signature-256 header when APP_SECRET is configured."""
+    if not APP_SECRET:
+        return True
+    expected = "sha256=" + hmac.new(APP_SECRET.encode(), request.body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, request.headers.get("X-Hub-Signature-256", ""))
+
+
+def acquire_sender_lock(sender_id: str):
+    """
+    Wait for the per-phone lock (cache SET NX with a TTL), so a quick
+    double message is answered after, and with the context of, the first.
+    Returns this holder's token, or None if waiting gave up after the TTL.
+    """
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + SENDER_LOCK_TTL
+    while not cache.add(f"whlock:{sender_id}", token, SENDER_LOCK_TTL):
+        if time.monotonic() >= deadline:
+            logger.warning("[WARN] Sender lock for %s timed out, processing anyway", sender_id)
+            return None
+        time.sleep(SENDER_LOCK_POLL)
+    return token
+
+
+def release_sender_lock(sender_id: str, token):
+    """
+    Release the lock only if `token` still holds it: after a timeout or a
+    TTL expiry the key may belong to another worker. (get + delete is not
+    atomic, but the window is far shorter than the TTL.)
+    """
+    key = f"whlock:{sender_id}"
+    if token is not None and cache.get(key) == token:
+        cache.delete(key)
+
+
+def process_webhook_message(sender_id: str, incoming_msg: str):
     """
     Background processing function for webhook messages.
-    This runs in a separate thread to avoid blocking the response.
+    This runs on WEBHOOK_POOL to avoid blocking the response;
+    meta_webhook has already parsed and de-duplicated the message.
     """
+    lock_token = acquire_sender_lock(sender_id)
     try:
-        value = data['entry'][0]['changes'][0]['value']
-        if 'messages' not in value:
-            return
-            
-        incoming_msg = value['messages'][0]['text']['body']
-        sender_id = value['messages'][0]['from']
-        message_id = value['messages'][0].get('id')
-        
-        print(f"Processing message: {incoming_msg[:50]}")
+        logger.info("Processing message: %.50s", incoming_msg)
 
-        candidate, _ = Candidate.objects.get_or_create(
-            phone_number=sender_id,
-            defaults={'name': 'Unknown', 'surname': 'Unknown', 'processed_message_ids': []}
-        )
+        candidate = Candidate.upsert(sender_id, name='Unknown', surname='Unknown')
 
-        # Initialize fields if None
-        if candidate.processed_message_ids is None:
-            candidate.processed_message_ids = []
-        if candidate.history is None:
-            candidate.history = []
-        
-        # MESSAGE DEDUPLICATION - prevent loop
-        if message_id and message_id in candidate.processed_message_ids:
-            print(f"[WARN] Duplicate message {message_id} - skipping")
-            return
-        
-        # Mark message as processed
-        if message_id:
-            candidate.processed_message_ids.append(message_id)
-            # Keep only last 100 message IDs
-            if len(candidate.processed_message_ids) > 100:
-                candidate.processed_message_ids = candidate.processed_message_ids[-100:]
-        
-        candidate.history.append({"from": "user", "text": incoming_msg})
-        candidate.save()
+        # Insert the user turn right away (admins see it live) and count it in
+        # the same transaction, so a failure later in the turn can never leave
+        # user_message_count behind the stored user messages
+        with transaction.atomic():
+            Message.objects.create(candidate=candidate, role="user", text=incoming_msg)
+            candidate.touch(user_message_count=F("user_message_count") + 1)
+        candidate.user_message_count += 1
 
         # ===== TWO-TIER ESCALATION =====
         
         # Tier 1: Fast keyword check BEFORE reply (explicit human requests)
-        if check_immediate_escalation(incoming_msg):
-            candidate.status = "escalated"
-            candidate.escalation_reason = "Immediate escalation (explicit request)"
-            candidate.save()
-            send_escalation_email(candidate)
+        escalation_lang = immediate_escalation_language(incoming_msg)
+        if escalation_lang:
+            candidate.touch(
+                status="escalated",
+                escalation_reason="Immediate escalation (explicit request)",
+            )
+            # SMTP can take seconds; the handoff message shouldn't wait for it
+            BG_POOL.submit(send_escalation_email, candidate)
             
-            # Send handoff message
-            lang = detect_language(incoming_msg)
+            # Send handoff message in the language of the matched phrase
+            lang = escalation_lang
             handoff_msg = "Ti metto in contatto con un operatore. A breve riceverai assistenza." if lang == "it" else "I'll connect you with an operator. You'll receive assistance shortly."
             send_text_message(sender_id, handoff_msg)
-            print("[ESCALATION] Immediate escalation triggered")
+            logger.info("[ESCALATION] Immediate escalation triggered")
             return
         
         # Skip if already escalated
         if candidate.status == 'escalated':
-            print("[ESCALATION] Bot paused for this user (already escalated).")
+            logger.info("[ESCALATION] Bot paused for this user (already escalated).")
             return
 
-        # ===== Orchestrated normal reply =====
-        reply = orchestrated_reply(candidate, incoming_msg)
+        # Detected once: the summary and the reply share the message's language.
+        # Messages without language markers keep the chat's last language
+        lang = detect_language(incoming_msg, candidate.preferred_language)
 
-        # Save + send
-        candidate.history.append({"from": "bot", "text": reply})
-        candidate.status = "replied"
-        candidate.save()
+        # Start the rolling summary now so its GPT call overlaps the main reply
+        BG_POOL.submit(summarize_if_needed, candidate.pk, lang)
 
-        send_text_message(sender_id, reply)
-        print("[INFO] Replied successfully")
+        # ===== Orchestrated normal reply =====
+        # GPT replies are sent from the stream as soon as their text is
+        # complete; canned and cached replies, and streamed sends Meta
+        # surely never got, are sent below
+        streamed = []
 
-        # ===== Tier 2: Background escalation analysis (after reply sent) =====
-        # Spawn background thread for GPT-based frustration detection
-        thread = threading.Thread(target=run_background_escalation_check, args=(candidate, incoming_msg))
-        thread.daemon = True
-        thread.start()
-        
-        # Run summarization in background too
-        def background_summarize():
+        def send_streamed(text):
             try:
-                summarize_if_needed(candidate)
+                send_text_message(sender_id, text)
             except Exception as e:
-                print(f"[WARN] Background summary failed: {e}")
-        
-        summary_thread = threading.Thread(target=background_summarize)
-        summary_thread.daemon = True
-        summary_thread.start()
+                if send_never_reached_meta(e):
+                    raise
+                # May have been delivered: sending again could duplicate it
+                logger.error("[ERROR] Streamed reply to %s may not have been delivered, not resending: %s",
+                             sender_id, e)
+            streamed.append(text)
+
+        reply, escalation_scores = orchestrated_reply(candidate, incoming_msg, lang, on_reply=send_streamed)
+
+        # Save (bot turn + status + last_updated in one UPDATE) + send
+        candidate.append_history(
+            {"from": "bot", "text": reply},
+            status="replied", preferred_language=lang,
+        )
+
+        if not streamed:
+            send_text_message(sender_id, reply)
+        logger.info("[INFO] Replied successfully")
+
+        # ===== Tier 2: Background escalation analysis (after reply sent) =====
+        # The orchestrator already scored this turn; the separate classifier
+        # only runs for replies that skipped GPT (small talk, errors)
+        if escalation_scores is not None:
+            BG_POOL.submit(apply_escalation_scores, candidate, escalation_scores)
+        else:
+            BG_POOL.submit(run_background_escalation_check, candidate, incoming_msg)
 
     except Exception as e:
-        print("[ERROR] Error in background processing:", e)
+        logger.exception("[ERROR] Error in background processing: %s", e)
+    finally:
+        release_sender_lock(sender_id, lock_token)
+        invalidate_admin_cache()
 
 
 @csrf_exempt
@@ -741,19 +1313,29 @@ def meta_webhook(request):
         return HttpResponse("Verification failed", status=403)
 
     if request.method == 'POST':
+        if not valid_signature(request):
+            logger.warning("[WARN] Invalid webhook signature")
+            return HttpResponse(status=403)
         try:
-            data = json.loads(request.body.decode("utf-8"))
+            data = orjson.loads(request.body)
         except Exception as e:
-            print("Error parsing JSON:", e)
+            logger.warning("Error parsing JSON: %s", e)
             return HttpResponse(status=400)
 
-        print("Incoming from Meta")
-        
+        logger.debug("Incoming from Meta")
+
+        inbound = parse_inbound_message(data)
+        if inbound is None:
+            return JsonResponse({"status": "ignored"})
+        sender_id, message_id, incoming_msg = inbound
+
+        # MESSAGE DEDUPLICATION - Meta retries the same id if we were slow
+        if not claim_message(message_id):
+            logger.warning("[WARN] Duplicate message %s - skipping", message_id)
+            return JsonResponse({"status": "duplicate"})
+
         # RETURN 200 OK IMMEDIATELY - process in background
-        # Start background thread to process message
-        thread = threading.Thread(target=process_webhook_message, args=(data,))
-        thread.daemon = True
-        thread.start()
+        WEBHOOK_POOL.submit(process_webhook_message, sender_id, incoming_msg)
 
         return JsonResponse({"status": "received"})
 
@@ -762,85 +1344,211 @@ def meta_webhook(request):
 # Admin / Upload / Reports (unchanged)
 # ==============================
 
-@csrf_exempt
-def upload_excel(request):
-    if request.method == 'POST':
-        file = request.FILES.get('file')
-        if not file:
-            return JsonResponse({'error': 'No file uploaded'}, status=400)
-
+def normalize_phone_column(phones):
+    """
+    normalize_phone for a whole pandas column in one vectorized pass.
+    Missing cells stay <NA> so they are still reported as failed.
+    """
+    if pd.api.types.is_float_dtype(phones):
         try:
-            df = pd.read_excel(file)
-            added, skipped, failed = 0, 0, []
+            # Phone columns with blanks are read as floats (393331234567.0)
+            phones = phones.astype('Int64')
+        except (TypeError, ValueError):
+            pass
+    return phones.astype('string').str.replace(r'\D+', '', regex=True)
 
-            for _, row in df.iterrows():
-                phone = str(row.get('phone_number')).replace("+", "").replace(" ", "")
-                if not phone or phone.lower() == 'nan':
-                    failed.append(phone)
-                    continue
 
-                if Candidate.objects.filter(phone_number=phone).exists():
-                    skipped += 1
-                    continue
+def iter_excel_rows(file):
+    """
+    Yield the rows of an uploaded workbook as header -> value mappings.
+    Small files go through pandas; larger ones are streamed with openpyxl in
+    read-only mode so the whole sheet is never materialized in memory.
+    """
+    if file.size < EXCEL_STREAMING_THRESHOLD:
+        df = pd.read_excel(file, usecols=lambda c: str(c).strip() in UPLOAD_COLUMNS)
+        df.columns = [str(c).strip() for c in df.columns]
+        if 'phone_number' in df.columns:
+            df['phone_number'] = normalize_phone_column(df['phone_number'])
+        columns = list(df.columns)
+        # itertuples keeps per-column dtypes and skips building a Series per row
+        for values in df.itertuples(index=False, name=None):
+            yield dict(zip(columns, values))
+        return
 
-                Candidate.objects.create(
+    wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if not header:
+            return
+        # Unused columns map to None and are dropped below with the empty cells
+        columns = [str(h).strip() if str(h).strip() in UPLOAD_COLUMNS else None for h in header]
+        for values in rows:
+            # Empty cells are dropped so row.get(col, default) behaves like a missing column
+            yield {
+                col: value for col, value in zip(columns, values)
+                if col is not None and value is not None
+            }
+    finally:
+        wb.close()
+
+
+def ingest_candidates(rows_iter):
+    """
+    Create Candidates for the new phone numbers in the uploaded rows.
+    Must run inside a transaction; returns (template_jobs, skipped, failed)
+    where each job is (phone, first_name, company, job_position).
+    """
+    skipped, failed = 0, []
+    seen, jobs = set(), []
+
+    while True:
+        chunk = list(islice(rows_iter, UPLOAD_CHUNK_ROWS))
+        if not chunk:
+            break
+
+        # Normalize and de-duplicate phones first so each chunk costs one
+        # existence query and one batched insert.
+        rows = []
+        for row in chunk:
+            raw_phone = row.get('phone_number')
+            phone = normalize_phone(raw_phone)
+            if not phone:
+                failed.append(str(raw_phone))
+                continue
+
+            if phone in seen:
+                skipped += 1
+                continue
+            seen.add(phone)
+            rows.append((phone, row))
+
+        # Lock the rows that already exist so they can't change under the upload
+        existing = set(
+            Candidate.objects.select_for_update()
+            .filter(phone_number__in=[phone for phone, _ in rows])
+            .values_list('phone_number', flat=True)
+        )
+        new_rows = [(phone, row) for phone, row in rows if phone not in existing]
+        skipped += len(rows) - len(new_rows)
+
+        # Existing candidates are left untouched (an upsert would reset the
+        # status of escalated chats), so conflicts are simply ignored.
+        Candidate.objects.bulk_create(
+            [
+                Candidate(
                     name=row.get('name', 'Unknown'),
                     surname=row.get('surname', 'Unknown'),
                     phone_number=phone,
                     status='sent'
                 )
+                for phone, row in new_rows
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+        for phone, row in new_rows:
+            first_name = str(row.get('name', '')).strip()
+            if not first_name:
+                first_name = "Amico"
+
+            company = str(
+                row.get('company_name',
+                        row.get('company',
+                                row.get('nome_azienda', 'InPlace.it')))
+            ).strip()
+            if not company or company.lower() == 'nan':
+                company = "InPlace.it"
+
+            job_position = str(
+                row.get('job_position',
+                        row.get('job_title',
+                                row.get('nome_posizione_lavorativa', 'la posizione proposta')))
+            ).strip()
+            if not job_position or job_position.lower() == 'nan':
+                job_position = "la posizione proposta"
+
+            jobs.append((phone, first_name, company, job_position))
+
+    return jobs, skipped, failed
+
 
+@csrf_exempt
+def upload_excel(request):
+    if request.method == 'POST':
+        file = request.FILES.get('file')
+        if not file:
+            return JsonResponse({'error': 'No file uploaded'}, status=400)
+
+        try:
+            # One transaction for the whole file; Meta sends happen after commit
+            # so no locks are held across HTTP calls.
+            with transaction.atomic():
+                jobs, skipped, failed = ingest_candidates(iter_excel_rows(file))
+            added = 0
+
+            def send_job(job):
+                phone, first_name, company, job_position = job
                 try:
-                    first_name = str(row.get('name', '')).strip()
-                    if not first_name:
-                        first_name = "Amico"
-
-                    company = str(
-                        row.get('company_name',
-                                row.get('company',
-                                        row.get('nome_azienda', 'InPlace.it')))
-                    ).strip()
-                    if not company or company.lower() == 'nan':
-                        company = "InPlace.it"
-
-                    job_position = str(
-                        row.get('job_position',
-                                row.get('job_title',
-                                        row.get('nome_posizione_lavorativa', 'la posizione proposta')))
-                    ).strip()
-                    if not job_position or job_position.lower() == 'nan':
-                        job_position = "la posizione proposta"
-
-                    print(f"[BULK] Sending to {phone} with name: {first_name}, company: {company}, position: {job_position}")
+                    logger.info("[BULK] Sending to %s with name: %s, company: %s, position: %s", phone, first_name, company, job_position)
                     send_onboarding_template(phone, first_name, company, job_position)
-                    added += 1
+                    return phone, None
                 except Exception as e:
-                    print(f"[ERROR] Failed to send to {phone}: {e}")
-                    failed.append(phone)
+                    return phone, e
 
+            # Meta sends are network-bound, so fan them out over the shared pool
+            send_failures = []
+            for phone, error in TEMPLATE_POOL.map(send_job, jobs):
+                if error is None:
+                    added += 1
+                else:
+                    logger.error("[ERROR] Failed to send to %s: %s", phone, error)
+                    send_failures.append(phone)
+
+            # One UPDATE for every candidate whose template didn't go out
+            if send_failures:
+                Candidate.objects.filter(
+                    phone_number__in=send_failures, status='sent'
+                ).update(status='failed')
+                failed.extend(send_failures)
+
+            invalidate_admin_cache()
             return JsonResponse({'success': True, 'added': added, 'skipped': skipped, 'failed': failed})
 
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
 
     return render(request, 'admin_panel.html', {
-        'candidates': Candidate.objects.all().order_by('-last_updated')[:200]
+        'candidates': Candidate.objects.only('name', 'phone_number', 'status', 'last_updated')
+        .order_by('-last_updated')[:200]
     })
 
 
 @require_GET
 def get_escalated(request):
-    candidates = Candidate.objects.filter(status='escalated')
-    data = [{'name': c.name, 'phone_number': c.phone_number} for c in candidates]
-    return JsonResponse(data, safe=False)
+    data = cache.get(ESCALATED_CACHE_KEY)
+    if data is None:
+        # Filtered via the partial status index; two columns as tuples, no model instances
+        rows = Candidate.objects.filter(status='escalated').values_list('name', 'phone_number')
+        data = [{'name': name, 'phone_number': phone_number} for name, phone_number in rows]
+        cache.set(ESCALATED_CACHE_KEY, data, ADMIN_CACHE_TTL)
+    return OrjsonResponse(data)
 
 
 @require_GET
 def get_chat_history(request):
     phone = request.GET.get('phone')
+    # Optional ?limit=N: only the newest N entries (the admin panel polls this)
     try:
-        candidate = Candidate.objects.get(phone_number=phone)
-        return JsonResponse({'history': candidate.history or []})
+        limit = int(request.GET.get('limit') or 0) or None
+        if limit is not None and limit < 0:
+            raise ValueError(limit)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a positive integer'}, status=400)
+    try:
+        candidate = Candidate.objects.only('pk').get(phone_number=phone)
+        return OrjsonResponse({'history': candidate.history_entries(limit=limit)})
     except Candidate.DoesNotExist:
         return JsonResponse({'history': []})
 
@@ -848,47 +1556,48 @@ def get_chat_history(request):
 @csrf_exempt
 @require_POST
 def send_admin_reply(request):
-    data = json.loads(request.body)
+    data = orjson.loads(request.body)
     phone = data.get('phone_number')
     text = data.get('text')
 
-    headers = {
-        "Authorization": f"Bearer {ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    url = f"https://graph.facebook.com/v19.0/{PHONE_NUMBER_ID}/messages"
-    payload = {
-        "messaging_product": "whatsapp",
-        "to": phone,
-        "type": "text",
-        "text": {"body": text}
-    }
-    requests.post(url, json=payload, headers=headers)
+    try:
+        candidate = Candidate.objects.only('pk').get(phone_number=phone)
+    except Candidate.DoesNotExist:
+        return JsonResponse({"sent": False, "error": "Unknown candidate"}, status=404)
 
-    candidate = Candidate.objects.get(phone_number=phone)
-    if candidate.history is None:
-        candidate.history = []
-    candidate.history.append({"from": "admin", "text": text})
-    candidate.save()
+    # Sent inline so the admin sees whether WhatsApp accepted the message;
+    # only a delivered reply is recorded in the chat
+    try:
+        send_text_message(phone, text)
+    except Exception as e:
+        logger.error("[ERROR] Admin reply to %s failed: %s", phone, e)
+        return JsonResponse({"sent": False, "error": str(e)}, status=502)
 
+    candidate.append_history({"from": "admin", "text": text})
+    invalidate_admin_cache()
     return JsonResponse({"sent": True})
 
 
 @csrf_exempt
 @require_POST
 def resume_bot(request):
-    data = json.loads(request.body)
+    data = orjson.loads(request.body)
     phone = data.get('phone_number')
     try:
-        candidate = Candidate.objects.get(phone_number=phone)
+        candidate = Candidate.objects.only(
+            'status', 'escalation_reason', 'last_updated'
+        ).get(phone_number=phone)
         candidate.status = 'replied'
         candidate.escalation_reason = None
 
-        # Trim chat history to remove old frustration context
-        if candidate.history:
-            candidate.history = candidate.history[-3:]  # keep only last 3 messages
+        # Trim chat history to remove old frustration context: only the last
+        # 3 chat turns survive; the bot's state and summary memory are kept
+        chat = candidate.messages.filter(role__in=CHAT_ROLES)
+        keep = chat.order_by('-created', '-id').values_list('id', flat=True)[:3]
+        chat.exclude(id__in=list(keep)).delete()
 
-        candidate.save()
+        candidate.save(update_fields=['status', 'escalation_reason', 'last_updated'])
+        invalidate_admin_cache()
         return JsonResponse({"resumed": True})
     except Candidate.DoesNotExist:
         return JsonResponse({"resumed": False})
@@ -896,60 +1605,88 @@ def resume_bot(request):
 
 @require_GET
 def get_all_chats(request):
-    candidates = Candidate.objects.exclude(history=None).order_by('-last_updated')
-    data = []
-    for c in candidates:
-        last_msg = c.history[-1] if c.history else {}
-        data.append({
-            "name": c.name,
-            "phone_number": c.phone_number,
-            "status": c.status,
-            "last_message": last_msg.get("text", ""),
-            "last_sender": last_msg.get("from", ""),
-            "last_updated": c.last_updated.strftime("%Y-%m-%d %H:%M")
-        })
-    return JsonResponse(data, safe=False)
-
-
-from django.db.models import Count
+    data = cache.get(ALL_CHATS_CACHE_KEY)
+    if data is None:
+        data = list_chats()
+        cache.set(ALL_CHATS_CACHE_KEY, data, ADMIN_CACHE_TTL)
+    return OrjsonResponse(data)
+
+
+def list_chats():
+    """One row per candidate with chat history, most recently updated first."""
+    # Last chat message per candidate (the bot's state and summary rows are
+    # written after the turn and are not shown), via the (candidate, -created) index
+    last = Message.objects.filter(candidate=OuterRef('pk'), role__in=CHAT_ROLES).order_by('-created', '-id')
+    rows = (
+        Candidate.objects
+        .annotate(
+            last_message=Subquery(last.values('text')[:1]),
+            last_sender=Subquery(last.values('role')[:1]),
+        )
+        .filter(last_sender__isnull=False)
+        .order_by('-last_updated')
+        # Plain tuples: no model instances are built for a read-only list
+        .values_list('name', 'phone_number', 'status', 'last_message', 'last_sender', 'last_updated')
+    )
+    return [
+        {
+            "name": name,
+            "phone_number": phone_number,
+            "status": status,
+            "last_message": last_message or "",
+            "last_sender": last_sender or "",
+            "last_updated": last_updated.strftime("%Y-%m-%d %H:%M")
+        }
+        for name, phone_number, status, last_message, last_sender, last_updated
+        in rows.iterator(chunk_size=200)
+    ]
+
 
 @require_GET
 def get_report_stats(request):
-    candidates = Candidate.objects.all()
-    total_users = candidates.count()
-    total_messages = 0
-    bot_messages = 0
-    user_messages = 0
-    admin_messages = 0
-    conversation_lengths = []
-
-    for c in candidates:
-        history = c.history or []
-        total_messages += len(history)
-        conversation_lengths.append(len(history))
-        for m in history:
-            sender = m.get("from")
-            if sender == "bot":
-                bot_messages += 1
-            elif sender == "user":
-                user_messages += 1
-            elif sender == "admin":
-                admin_messages += 1
-
-    average_length = round(sum(conversation_lengths) / total_users, 2) if total_users > 0 else 0
-
-    sent = candidates.filter(status='sent').count()
-    replied = candidates.filter(status='replied').count()
-    escalated = candidates.filter(status='escalated').count()
+    stats = cache.get(REPORT_STATS_CACHE_KEY)
+    if stats is None:
+        stats = compute_report_stats()
+        cache.set(REPORT_STATS_CACHE_KEY, stats, REPORT_STATS_CACHE_TTL)
+    return JsonResponse(stats)
+
+
+def compute_report_stats():
+    """Aggregate numbers for the admin report panel."""
+    # Funnel counts in one aggregate query instead of a count() per status
+    escalated_q = Q(status='escalated')
+    funnel = Candidate.objects.aggregate(
+        total_users=Count('id'),
+        sent=Count('id', filter=Q(status='sent')),
+        replied=Count('id', filter=Q(status='replied')),
+        escalated=Count('id', filter=escalated_q),
+        with_reason=Count(
+            'id', filter=escalated_q & ~Q(escalation_reason=None) & ~Q(escalation_reason='')
+        ),
+    )
+    total_users = funnel['total_users']
+
+    role_counts = dict(Message.objects.values_list('role').annotate(n=Count('id')).order_by())
+    total_messages = sum(role_counts.values())
+    bot_messages = role_counts.get("bot", 0)
+    user_messages = role_counts.get("user", 0)
+    admin_messages = role_counts.get("admin", 0)
+
+    average_length = round(total_messages / total_users, 2) if total_users > 0 else 0
+
+    sent = funnel['sent']
+    replied = funnel['replied']
+    escalated = funnel['escalated']
 
     # Define "Completed Onboarding" as having at least 6 bot replies
-    completed_onboarding = sum(
-        1 for c in candidates if sum(1 for m in (c.history or []) if m.get("from") == "bot") >= 6
+    completed_onboarding = (
+        Message.objects.filter(role="bot").values('candidate')
+        .annotate(n=Count('id')).filter(n__gte=6).count()
     )
 
-    with_reason = sum(1 for c in candidates if c.status == 'escalated' and c.escalation_reason)
+    with_reason = funnel['with_reason']
 
-    return JsonResponse({
+    return {
         "summary": {
             "total_users": total_users,
             "total_messages": total_messages,
@@ -968,7 +1705,7 @@ def get_report_stats(request):
             "total_escalated": escalated,
             "with_reason": with_reason
         }
-    })
+    }
 
 
 from django.core.mail import send_mail
@@ -994,6 +1731,6 @@ Check the admin panel for full chat history.
             [os.getenv("ADMIN_ALERT_EMAIL")],
             fail_silently=False,
         )
-        print("[INFO] Email sent to admin.")
+        logger.info("[INFO] Email sent to admin.")
     except Exception as e:
-        print("[ERROR] Failed to send email:", e)
+        logger.error("[ERROR] Failed to send email: %s", e)
@@ -0,0 +1,17 @@
+"""
+Non-blocking log output: request threads only enqueue records, and a
+listener thread does the actual stream writes.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+
+
+def queue_handler():
+    """Handler factory for LOGGING (dictConfig "()" key)."""
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    listener.start()
+    atexit.register(listener.stop)
+    return logging.handlers.QueueHandler(log_queue)
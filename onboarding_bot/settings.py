@@ -153,3 +153,28 @@ EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+
+
+# Message-id de-duplication and the per-sender webhook lock use this cache.
+# LocMemCache is per process: fine for the single gunicorn worker in the
+# Procfile, but with several workers or hosts point it at a shared backend
+# (Redis / Memcached) or those guarantees only hold within each process.
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+}
+
+
+# App logs go through a queue so webhook / pool threads never block on stdout
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "plain": {"format": "%(asctime)s %(levelname)s %(name)s %(message)s"},
+    },
+    "handlers": {
+        "queue": {"()": "onboarding_bot.log_queue.queue_handler", "formatter": "plain"},
+    },
+    "loggers": {
+        "onboarding": {"handlers": ["queue"], "level": os.getenv("ONBOARDING_LOG_LEVEL", "INFO")},
+    },
+}